@@ -0,0 +1,98 @@
+'''In-memory index of Sentinel-2 acquisitions per MGRS tile, answers region queries without EE calls.'''
+import math
+from collections import defaultdict
+
+import geometry
+
+
+class AcquisitionIndex(object):
+    """
+    Acquisition times, cloud percentages and footprints per MGRS tile, with a regular grid over tile
+    bounds for region lookups. Footprints are simplified polygons, partial swaths at the edge of an orbit
+    cover only part of their bounds.
+    """
+
+    def __init__(self, tiles, updated, cell_size=0.5):
+        """
+        :param tiles: list of {'tile': ..., 'times': [...], 'cloud': [...], 'bounds': [xmin, ymin, xmax, ymax, ...],
+        'footprints': [x, y, ...], 'footprint_sizes': [...]}, bounds are flattened footprint bounds, one per
+        acquisition, footprints are flattened exterior rings of all acquisitions with the number of vertices
+        per acquisition in footprint_sizes. Tiles without footprints are queried by bounds.
+        :param updated: time of the last refresh (milliseconds)
+        :param cell_size: grid cell size in degrees
+        """
+        self.tiles = tiles
+        self.updated = updated
+        self.cell_size = cell_size
+
+        self._grid = defaultdict(list)
+        self._footprints = [self._get_footprints(tile) for tile in tiles]
+
+        for i, tile in enumerate(tiles):
+            if not tile['times']:
+                continue
+
+            for cell in self._get_cells(self._get_tile_bounds(tile)):
+                self._grid[cell].append(i)
+
+    @staticmethod
+    def _get_acquisition_bounds(tile, i):
+        return tile['bounds'][4 * i:4 * i + 4]
+
+    @staticmethod
+    def _get_footprints(tile):
+        if 'footprints' not in tile:
+            return None
+
+        coordinates = tile['footprints']
+        footprints = []
+        offset = 0
+
+        for size in tile['footprint_sizes']:
+            footprints.append([coordinates[j:j + 2] for j in range(offset, offset + 2 * size, 2)])
+            offset += 2 * size
+
+        return footprints
+
+    def _get_tile_bounds(self, tile):
+        bounds = [self._get_acquisition_bounds(tile, i) for i in range(len(tile['times']))]
+        xmin, ymin, xmax, ymax = zip(*bounds)
+
+        return [min(xmin), min(ymin), max(xmax), max(ymax)]
+
+    def _get_cells(self, bounds):
+        xmin, ymin, xmax, ymax = bounds
+
+        for i in range(int(math.floor(xmin / self.cell_size)), int(math.floor(xmax / self.cell_size)) + 1):
+            for j in range(int(math.floor(ymin / self.cell_size)), int(math.floor(ymax / self.cell_size)) + 1):
+                yield i, j
+
+    def query(self, bounds, time_begin, time_end, max_cloud):
+        """
+        Returns acquisition times of images with a footprint intersecting bounds
+        :param bounds: [xmin, ymin, xmax, ymax] in longitude, latitude
+        :param time_begin: milliseconds
+        :param time_end: milliseconds, exclusive
+        :param max_cloud: maximum cloudy pixel percentage
+        :return: sorted list of times (milliseconds)
+        """
+        candidates = set()
+        for cell in self._get_cells(bounds):
+            candidates.update(self._grid.get(cell, []))
+
+        times = set()
+        for index in candidates:
+            tile = self.tiles[index]
+            footprints = self._footprints[index]
+
+            for i, (time, cloud) in enumerate(zip(tile['times'], tile['cloud'])):
+                if not (time_begin <= time < time_end and cloud <= max_cloud) or time in times:
+                    continue
+
+                if not geometry.intersects(bounds, self._get_acquisition_bounds(tile, i)):
+                    continue
+
+                if footprints is None or geometry.ring_intersects(footprints[i], bounds):
+                    times.add(time)
+
+        return sorted(times)
@@ -0,0 +1,59 @@
+import os
+import sys
+
+# acquisitions imports sibling modules the same way api.py does
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from . import acquisitions  # noqa: E402
+
+
+def test_acquisition_index_query():
+    tiles = [
+        {
+            'tile': '31UFT',
+            'times': [1000, 2000, 3000],
+            'cloud': [5.0, 50.0, 0.0],
+            'bounds': [5.0, 51.3, 6.5, 52.3] * 2 + [5.0, 51.3, 5.5, 52.3]
+        },
+        {
+            'tile': '31UGT',
+            'times': [1500],
+            'cloud': [1.0],
+            'bounds': [6.4, 51.3, 7.9, 52.3]
+        }
+    ]
+
+    index = acquisitions.AcquisitionIndex(tiles, updated=0)
+
+    # region in the east of 31UFT, partial swath of the last acquisition does not cover it
+    assert index.query([5.8, 51.9, 5.9, 52.0], 0, 10000, 10) == [1000]
+    assert index.query([5.8, 51.9, 5.9, 52.0], 0, 10000, 100) == [1000, 2000]
+
+    # region covered by both tiles
+    assert index.query([6.45, 51.9, 6.48, 52.0], 0, 10000, 10) == [1000, 1500]
+    assert index.query([6.45, 51.9, 6.48, 52.0], 1200, 10000, 10) == [1500]
+
+    # region outside of all tiles
+    assert index.query([9.0, 51.9, 9.1, 52.0], 0, 10000, 100) == []
+
+
+def test_acquisition_index_query_footprints():
+    # second acquisition is a partial swath, a triangle in the south-east half of the tile bounds
+    tiles = [
+        {
+            'tile': '31UFT',
+            'times': [1000, 2000],
+            'cloud': [0.0, 0.0],
+            'bounds': [5.0, 51.3, 6.5, 52.3] * 2,
+            'footprints': [5.0, 51.3, 6.5, 51.3, 6.5, 52.3, 5.0, 52.3, 5.0, 51.3] + [5.0, 51.3, 6.5, 51.3, 6.5, 52.3],
+            'footprint_sizes': [5, 3]
+        }
+    ]
+
+    index = acquisitions.AcquisitionIndex(tiles, updated=0)
+
+    # region in the south-east, covered by both acquisitions
+    assert index.query([6.2, 51.4, 6.3, 51.5], 0, 10000, 10) == [1000, 2000]
+
+    # region in the north-west, within bounds of the partial swath but outside of its footprint
+    assert index.query([5.1, 52.1, 5.2, 52.2], 0, 10000, 10) == [1000]
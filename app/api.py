@@ -1,13 +1,26 @@
 import os
 import json
+import itertools
+import threading
+import traceback
 from datetime import datetime, timedelta
-from flask import Flask, jsonify, redirect, request
+from flask import Flask, Response, jsonify, redirect, request, stream_with_context
 import flask_cors
 from flasgger import Swagger
 import ee
 from google.cloud import firestore
+from google.api_core import exceptions as google_exceptions
 
 import error_handler
+import cache
+import singleflight
+import geometry
+import zonal
+import store
+import acquisitions
+import catalog
+import tile_cache
+import bulk_writer
 
 # import connexion
 
@@ -67,7 +80,11 @@ def to_date_time_string(millis):
     return ee.Date(millis).format('YYYY-MM-dd HH:mm')
 
 
-def get_satellite_images(region, date_begin, date_end, cloud_filtering):
+def get_satellite_images(region, date_begin, date_end, cloud_filtering, bounds=None):
+    """
+    :param bounds: region bounds in longitude and latitude, if defined, cloud filtering uses stored quality
+    scores when these cover the region and period
+    """
     images = ee.ImageCollection('COPERNICUS/S2') \
         .select(band_names['s2'], band_names['readable']) \
         .filterBounds(region)
@@ -83,7 +100,12 @@ def get_satellite_images(region, date_begin, date_end, cloud_filtering):
     }
 
     if cloud_filtering:
-        images = get_mostly_clean_images(images, region, options=filter_options)
+        image_ids = _get_stored_clean_image_ids(bounds, date_begin, date_end) if bounds else None
+
+        if image_ids is not None:
+            images = images.filter(ee.Filter.inList('system:index', image_ids))
+        else:
+            images = get_mostly_clean_images(images, region, options=filter_options)
 
     return images
 
@@ -122,6 +144,9 @@ def add_quality_score(images, g, score_percentile, scale):
     return images.map(cloud_score)
 
 
+cloud_frequency_nl = 0.7  # Calculated for the Netherlands, hardcoded for speed
+
+
 def get_mostly_clean_images(images, g, options=None):
     geometry = ee.Geometry(g)
     scale = 1000
@@ -136,9 +161,7 @@ def get_mostly_clean_images(images, g, options=None):
         if 'cloud_frequency_threshold_delta' in options:
             cloud_frequency_threshold_delta = options['cloud_frequency_threshold_delta']
 
-    cloud_frequency = 0.7  # Calculated for the Netherlands, hardcoded for speed
-
-    cloud_frequency = ee.Number(cloud_frequency)
+    cloud_frequency = ee.Number(cloud_frequency_nl)
 
     if cloud_frequency_threshold_delta:
         cloud_frequency = cloud_frequency.add(cloud_frequency_threshold_delta)
@@ -220,32 +243,149 @@ def get_ndvi(region, date_begin, date_end, vis):
     return ndvi.visualize(**vis)
 
 
-def _get_landuse(region, date_begin, date_end):
+landuse_training_image = 'projects/deltares-rws/vegetatiemonitor/fotointerpretatie-rijn-maas-merged-2017-image-10m'
+
+# sample point locations precomputed per z10 tile, see cmd_training_points.py
+landuse_training_points = 'projects/deltares-rws/vegetatiemonitor/fotointerpretatie-rijn-maas-training-points-z10'
+landuse_training_tiles = 'users/gdonchyts/vegetation-monitor-tiles-z10'
+
+asset_exists_cache = cache.TTLCache(maxsize=16, ttl=60 * 60)
+
+# trained classifiers, keyed on date range, snapped region footprint and training asset
+landuse_classifier_cache = cache.TTLCache(maxsize=128, ttl=24 * 60 * 60)
+
+# grid size (degrees) used to snap region footprints, nearby regions share a classifier
+landuse_footprint_grid = 0.05
+
+
+def _to_key(value):
+    if isinstance(value, ee.ComputedObject):
+        return value.serialize()
+
+    return value
+
+
+def _get_region_geometry(region):
+    if isinstance(region, dict) and region['type'] == 'FeatureCollection':
+        return ee.FeatureCollection(region['features']).geometry()
+
+    return region
+
+
+def _get_region_footprint(region):
     """
-    Computes landuse image using random forest algorithm given a (composite) image.
-    Uses RWS fotointerpretatie classes as a ground-truth.
+    Returns region bounds snapped to the footprint grid, or None if region is not a lat/lon GeoJSON
     :param region:
-    :param date_begin:
-    :param date_end:
+    :return:
+    """
+    if not isinstance(region, dict) or 'crs' in region:
+        return None
+
+    bounds = geometry.get_bounds(region)
+
+    return geometry.snap_bounds(bounds, landuse_footprint_grid)
+
+
+def _get_region_key(region):
+    """
+    Returns identity of a region used in cache keys, the footprint if defined, otherwise the region itself
+    """
+    footprint = _get_region_footprint(region)
+
+    if footprint:
+        return footprint
+
+    return cache.make_key('region', _to_key(region))
+
+
+def _asset_exists(asset_id):
+    exists = asset_exists_cache.get(asset_id)
+
+    if exists is None:
+        try:
+            exists = ee.data.getInfo(asset_id) is not None
+        except ee.EEException:
+            exists = False
+
+        asset_exists_cache.set(asset_id, exists)
+
+    return exists
+
+
+def get_landuse_training_points(tiles, points_per_class, seed=0):
+    """
+    Computes stratified sample point locations of RWS fotointerpretatie classes for every tile.
+    Points are sampled where both ground-truth classes and AHN are defined, only spectral values
+    need to be sampled at these points when a classifier is trained.
+    :param tiles: z10 tiles (ee.FeatureCollection)
+    :param points_per_class: number of points per class per tile
+    :param seed:
     :return:
     """
     class_property = 'Legger'
-    image_path = 'projects/deltares-rws/vegetatiemonitor/fotointerpretatie-rijn-maas-merged-2017-image-10m'
-    landuse_legger = ee.Image(image_path).rename(class_property)
+    landuse_legger = ee.Image(landuse_training_image).rename(class_property)
+    ahn = ee.Image('AHN/AHN2_05M_RUW')
 
-    # get an image given region and dates
-    images = get_satellite_images(region, date_begin, date_end, False) \
-        .map(lambda i: i.resample('bilinear'))
+    def sample_tile(tile):
+        points = landuse_legger \
+            .addBands(ahn.divide(100)) \
+            .stratifiedSample(**{
+                'numPoints': points_per_class,
+                'classBand': class_property,
+                'region': tile.geometry(),
+                'scale': 10,
+                'seed': seed,
+                'tileScale': 8,
+                'dropNulls': True,
+                'geometries': True
+            })
 
-    image = ee.Image(images.mosaic()).divide(10000)
+        return points \
+            .map(lambda p: p.copyProperties(tile, ['tx', 'ty'])) \
+            .select([class_property, 'tx', 'ty'])
+
+    return tiles.map(sample_tile).flatten()
+
+
+# number of training points per class, the same for precomputed and stratified samples
+landuse_training_points_per_class = 500
+
+
+def _limit_points_per_class(points, class_property, count, seed=0):
+    """
+    Returns a random subset of at most count points per class
+    """
+    points = points.randomColumn('random', seed)
+    classes = ee.List(points.aggregate_array(class_property)).distinct()
+
+    def limit_class(c):
+        return points.filter(ee.Filter.eq(class_property, c)).limit(count, 'random')
+
+    return ee.FeatureCollection(classes.map(limit_class)).flatten()
+
+
+def _get_landuse_training_samples(image, landuse_legger, region):
+    class_property = 'Legger'
+
+    if _asset_exists(landuse_training_points):
+        # sample spectral values at precomputed point locations, regions spanning multiple tiles contain
+        # points of every tile and are reduced to the same number of points per class as stratified sampling
+        points = ee.FeatureCollection(landuse_training_points).filterBounds(region)
+        points = _limit_points_per_class(points, class_property, landuse_training_points_per_class)
+
+        return image.sampleRegions(**{
+            'collection': points,
+            'properties': [class_property],
+            'scale': 10,
+            'tileScale': 8
+        })
 
     # add AHN for classification
     ahn = ee.Image('AHN/AHN2_05M_RUW')
 
     # sample values using stratified sampling
-    number_of_points = 500
     options = {
-        'numPoints': number_of_points,
+        'numPoints': landuse_training_points_per_class,
         'classBand': class_property,
         'region': region,
         'scale': 10,
@@ -253,23 +393,104 @@ def _get_landuse(region, date_begin, date_end):
         'dropNulls': True
     }
 
-    samples = image \
+    return image \
         .addBands(landuse_legger) \
         .addBands(ahn.divide(100)) \
         .stratifiedSample(**options)
 
+
+def _train_landuse_classifier(image, landuse_legger, region):
+    """
+    Trains random forest classifier using samples of RWS fotointerpretatie classes.
+    :param image: (composite) image with spectral bands used for classification
+    :param landuse_legger: image with ground-truth classes
+    :param region:
+    :return:
+    """
+    class_property = 'Legger'
+
+    samples = _get_landuse_training_samples(image, landuse_legger, region)
+
     # train random forest classifier
     number_of_trees = 15
 
     classifier = ee.Classifier.smileRandomForest(number_of_trees) \
         .train(samples, class_property, image.bandNames())
 
+    return classifier
+
+
+def _get_landuse_composite(region, date_begin, date_end):
+    images = get_satellite_images(region, date_begin, date_end, False) \
+        .map(lambda i: i.resample('bilinear'))
+
+    return ee.Image(images.mosaic()).divide(10000)
+
+
+def _get_landuse_trees(landuse_legger, footprint, date_begin, date_end):
+    """
+    Trains classifier for a region footprint and returns its decision trees.
+    """
+    region = ee.Geometry.Rectangle(footprint)
+
+    image = _get_landuse_composite(region, date_begin, date_end)
+
+    classifier = _train_landuse_classifier(image, landuse_legger, region)
+
+    return ee.List(ee.Dictionary(classifier.explain()).get('trees')).getInfo()
+
+
+def _get_landuse_classifier(image, landuse_legger, region, date_begin, date_end):
+    """
+    Returns classifier trained for a given mosaic, reuses trees of classifiers trained before
+    for the same date range and region footprint.
+    """
+    footprint = _get_region_footprint(region)
+
+    if not footprint:
+        return _train_landuse_classifier(image, landuse_legger, region)
+
+    training_assets = [landuse_training_image]
+    if _asset_exists(landuse_training_points):
+        training_assets.append(landuse_training_points)
+
+    key = cache.make_key('landuse-classifier', _to_key(date_begin), _to_key(date_end),
+                         footprint, training_assets)
+
+    trees = landuse_classifier_cache.get(key)
+    if trees is None:
+        trees = requests_in_flight.do(key, _get_landuse_trees, landuse_legger, footprint, date_begin, date_end)
+
+        landuse_classifier_cache.set(key, trees)
+
+    return ee.Classifier.decisionTreeEnsemble(trees)
+
+
+def _get_landuse(region, date_begin, date_end):
+    """
+    Computes landuse image using random forest algorithm given a (composite) image.
+    Uses RWS fotointerpretatie classes as a ground-truth.
+    :param region: GeoJSON geometry, feature collection or ee.Geometry
+    :param date_begin:
+    :param date_end:
+    :return:
+    """
+    class_property = 'Legger'
+    landuse_legger = ee.Image(landuse_training_image).rename(class_property)
+
+    geom = _get_region_geometry(region)
+
+    # get an image given region and dates
+    image = _get_landuse_composite(geom, date_begin, date_end)
+
+    classifier = _get_landuse_classifier(image, landuse_legger, region, date_begin, date_end)
+
     # classify current image
     classified = image.classify(classifier)
 
     classified = classified \
         .updateMask(landuse_legger.mask()) \
-        .clip(region)
+        .clip(geom)
 
     return classified \
         .focal_mode(1)
@@ -364,13 +585,16 @@ def get_landuse_vs_legger(region, date_begin, date_end, vis):
     return diff
 
 
-def _get_legger_image(date_begin):
+def _get_legger_image_id(date_begin):
     if datetime.strptime(date_begin, '%Y-%m-%d') < datetime(2020, 5, 24):
-        legger = ee.Image('projects/deltares-rws/vegetatiemonitor/legger-2012-6-class-10m')\
-            .rename('type')
+        return 'projects/deltares-rws/vegetatiemonitor/legger-2012-6-class-10m'
     else:
-        legger = ee.Image('projects/deltares-rws/vegetatiemonitor/legger-2020-6-class-10m')\
-            .rename('type')
+        return 'projects/deltares-rws/vegetatiemonitor/legger-2020-6-class-10m'
+
+
+def _get_legger_image(date_begin):
+    legger = ee.Image(_get_legger_image_id(date_begin))\
+        .rename('type')
 
     return legger
 
@@ -391,12 +615,83 @@ maps = {
 }
 
 
+def _parse_date(value):
+    """
+    Parses a date string, datetime or time in milliseconds, returns None for other values (e.g. ee.Date)
+    """
+    if isinstance(value, datetime):
+        return value
+
+    if isinstance(value, int):
+        return datetime.utcfromtimestamp(value / 1000.0)
+
+    if not isinstance(value, str):
+        return None
+
+    for date_format in ['%Y-%m-%d', '%Y-%m-%dT%H:%M:%S', '%Y-%m-%dT%H:%M:%SZ', '%Y-%m-%dT%H:%M:%S.%fZ']:
+        try:
+            return datetime.strptime(value, date_format)
+        except ValueError:
+            pass
+
+    return None
+
+
+def _find_yearly_image_id(collection, region, date_begin, date_end):
+    """
+    Returns the asset id of the image EE selects as the first image of a collection within a region and time
+    range, using the local catalog. The first image in collection order with bounds intersecting the region
+    is selected if its footprint covers the region, otherwise the selection is ambiguous.
+    :param region: GeoJSON geometry or feature collection
+    :return: asset id, None if the catalog does not determine the image
+    """
+    bounds = geometry.get_lon_lat_bounds(region)
+    time_begin = _parse_date(date_begin)
+    time_end = _parse_date(date_end)
+
+    if not (bounds and time_begin and time_end):
+        return None
+
+    images = image_catalog.find(collection, bounds, _to_millis(time_begin), _to_millis(time_end))
+
+    if not images:
+        return None
+
+    image = min(images, key=lambda i: i['order'])
+
+    margin = catalog_footprint_margin
+    bounds = [bounds[0] - margin, bounds[1] - margin, bounds[2] + margin, bounds[3] + margin]
+
+    if image['footprint'] is None or not geometry.ring_contains(image['footprint'], bounds):
+        return None
+
+    return image['id']
+
+
+def _get_yearly_image(collection, region, date_begin, date_end):
+    """
+    Returns the first image of a yearly collection within a region and time range. The image is resolved
+    to its asset id using the local catalog if possible, so that EE does not need to filter the collection.
+    :param region: GeoJSON geometry or feature collection
+    """
+    image_id = _find_yearly_image_id(collection, region, date_begin, date_end)
+
+    if image_id:
+        return ee.Image(image_id)
+
+    if region['type'] == 'FeatureCollection':
+        region = ee.FeatureCollection(region['features']).geometry()
+
+    images = get_image_collection(collection, region, date_begin, date_end)
+
+    return ee.Image(images.first())
+
+
 def export_satellite_image(region, date_begin, date_end, vis, asset_type):
     if asset_type == 'day':
         image = get_satellite_image(region, date_begin, date_end, vis)
     else:
-        images = get_image_collection(yearly_collections["satellite"], region, date_begin, date_end)
-        image = ee.Image(images.first())
+        image = _get_yearly_image(yearly_collections["satellite"], region, date_begin, date_end)
         image = visualize_image(image, vis)
 
     return image
@@ -406,8 +701,7 @@ def export_ndvi(region, date_begin, date_end, vis, asset_type):
     if asset_type == 'day':
         image = _get_ndvi(date_begin, date_end, region)
     else:
-        images = get_image_collection(yearly_collections["satellite"], region, date_begin, date_end)
-        image = ee.Image(images.first())
+        image = _get_yearly_image(yearly_collections["satellite"], region, date_begin, date_end)
 
     return image
 
@@ -416,8 +710,7 @@ def export_landuse(region, date_begin, date_end, vis, asset_type):
     if asset_type == 'day':
         image = _get_landuse(region, date_begin, date_end)
     else:
-        images = get_image_collection(yearly_collections["landuse"], region, date_begin, date_end)
-        image = ee.Image(images.first())
+        image = _get_yearly_image(yearly_collections["landuse"], region, date_begin, date_end)
 
     return image
 
@@ -426,8 +719,7 @@ def export_landuse_vs_legger(region, date_begin, date_end, vis, asset_type):
     if asset_type == 'day':
         image = _get_landuse_vs_legger(region, date_begin, date_end)
     else:
-        images = get_image_collection(yearly_collections["landuse-vs-legger"], region, date_begin, date_end)
-        image = ee.Image(images.first()).int32()
+        image = _get_yearly_image(yearly_collections["landuse-vs-legger"], region, date_begin, date_end).int32()
 
     return image
 
@@ -440,75 +732,227 @@ exports = {
 }
 
 
-def _get_zonal_info(features, image, scale):
-    area = ee.Image.pixelArea().rename('area')
+# zonal statistics are computed for chunks of features, evaluated concurrently
+zonal_chunk_size = 200
+zonal_max_workers = 4
 
-    image = area.addBands(image)
+# zonal statistics per feature, keyed on geometry hash and image identity
+zonal_feature_cache = cache.TTLCache(maxsize=50000)
 
-    # for every input feature, compute area
+# results for classifications of daily images expire, yearly and legger results do not
+zonal_feature_ttl_day = 24 * 60 * 60
 
-    def get_feature_info(f):
-        f = ee.Feature(f)
 
-        reducer = ee.Reducer.sum().group(**{
-            "groupField": 1,
-            "groupName": 'type',
-        })
+def _get_feature_id(feature):
+    return (feature.get('properties') or {}).get('id')
 
-        geom = f.geometry()
 
-        area = image.reduceRegion(reducer, geom, scale)
+def _get_zonal_reducer():
+    return ee.Reducer.sum().group(**{
+        "groupField": 1,
+        "groupName": 'type',
+    })
 
-        def format_area(o):
-            o = ee.Dictionary(o)
 
-            t = ee.Number(o.get('type')).format('%d')
-            area = o.get('sum')
+def _get_zonal_areas(features, layers, scale):
+    """
+    Computes area per type for a chunk of features and one or more layers in a single
+    reduceRegions() call. Layers are stacked as bands, with a grouped sum reducer per layer.
+    :param features: list of GeoJSON features
+    :param layers: list of (name, image with types)
+    :param scale:
+    :return: list of {name: groups} per feature
+    """
+    if not layers:
+        raise ValueError('Error: at least one layer is required')
 
-            return {
-                "type": t,
-                "area": area
-            }
+    area = ee.Image.pixelArea()
 
-        area = ee.List(area.get('groups')).map(format_area)
+    bands = []
+    reducer = None
+    for i, (name, image) in enumerate(layers):
+        bands.append(area.rename('area_%d' % i))
+        bands.append(ee.Image(image).rename('type_%d' % i))
 
-        return {
-            "id": f.get('id'),
-            "area_per_type": area
-        }
+        layer_reducer = _get_zonal_reducer().setOutputs([name])
 
-    return features.toList(5000).map(get_feature_info)
+        if reducer is None:
+            reducer = layer_reducer
+        else:
+            reducer = reducer.combine(layer_reducer)
 
+    image = ee.Image.cat(bands)
 
-def get_zonal_info_landuse(region, date_begin, date_end, scale, asset_type):
-    features = ee.FeatureCollection(region["features"])
+    areas = image.reduceRegions(ee.FeatureCollection(features), reducer, scale)
+
+    names = [name for name, image in layers]
+
+    rows = areas.reduceColumns(ee.Reducer.toList(len(names)), names).get('list').getInfo()
+
+    return [dict(zip(names, row)) for row in rows]
+
+
+def _get_zonal_info(features, layers, scale, image_key, ttl=None, crs=None):
+    """
+    Computes area per type for every input feature, yields results as soon as a chunk is computed.
+    Results are cached per feature, only features missing from the cache are computed.
+    :param features: list of GeoJSON features
+    :param layers: list of (name, image with types)
+    :param scale:
+    :param image_key: identity of the images, part of the cache key
+    :param ttl: time-to-live of cached results, None means results do not expire
+    :param crs: crs of the feature geometries (GeoJSON crs of the region)
+    :return: generator of {name: groups} per feature
+    """
+    keys = [cache.make_key('zonal-info', f['geometry'], crs, image_key, scale) for f in features]
+
+    return zonal.imap_cached(lambda chunk: _get_zonal_areas(chunk, layers, scale), features, keys,
+                             zonal_feature_cache, zonal_chunk_size, zonal_max_workers, ttl)
+
+
+def _get_zonal_info_single(region, image, scale, image_key, ttl=None):
+    features = region["features"]
+    areas = _get_zonal_info(features, [('groups', image)], scale, image_key, ttl, region.get('crs'))
+
+    for f, area in zip(features, areas):
+        yield {
+            "id": _get_feature_id(f),
+            "area_per_type": zonal.format_groups(area['groups'])
+        }
+
+
+def _get_zonal_image_landuse(region, date_begin, date_end, asset_type):
+    """
+    :return: image, image identity and time-to-live of results
+    """
     if asset_type == 'day':
-        image = _get_landuse(features.geometry(), date_begin, date_end)
+        image = _get_landuse(region, date_begin, date_end)
+        # classification depends on the classifier trained for the region footprint (or the region)
+        image_key = ['landuse', asset_type, _to_key(date_begin), _to_key(date_end), _get_region_key(region)]
+        ttl = zonal_feature_ttl_day
     else:
-        images = get_image_collection(yearly_collections['landuse'], features.geometry(), date_begin, date_end)
-        image = ee.Image(images.first())
+        image = _get_yearly_image(yearly_collections['landuse'], region, date_begin, date_end)
+        image_id = _find_yearly_image_id(yearly_collections['landuse'], region, date_begin, date_end)
+
+        # the first image within the region is used, identified by its asset id if resolved by the catalog
+        if image_id:
+            image_key = ['landuse', asset_type, image_id]
+        else:
+            image_key = ['landuse', asset_type, yearly_collections['landuse'], _to_key(date_begin),
+                         _to_key(date_end), _get_region_key(region)]
+        ttl = None
+
+    return image, image_key, ttl
 
-    info = _get_zonal_info(features, image, scale)
 
-    return info.getInfo()
+def _get_zonal_image_legger(region, date_begin, date_end, asset_type):
+    """
+    :return: image, image identity and time-to-live of results
+    """
+    image = _get_legger_image(date_begin)
+    image_key = ['legger', _get_legger_image_id(date_begin)]
+
+    return image, image_key, None
+
+
+zonal_images = {
+    'landuse': _get_zonal_image_landuse,
+    'legger': _get_zonal_image_legger
+}
+
+
+def get_zonal_info_landuse(region, date_begin, date_end, scale, asset_type):
+    image, image_key, ttl = _get_zonal_image_landuse(region, date_begin, date_end, asset_type)
+
+    return _get_zonal_info_single(region, image, scale, image_key, ttl)
+
+
+def get_zonal_info_layers(ids, region, date_begin, date_end, scale, asset_type):
+    """
+    Computes area per type for multiple layers in one reduction per feature
+    :param ids: layer ids, see zonal_images
+    :return: generator of zonal info per feature, with area per type per layer
+    """
+    layers = []
+    image_keys = []
+    ttls = []
+    for id in ids:
+        image, image_key, ttl = zonal_images[id](region, date_begin, date_end, asset_type)
+
+        layers.append((id, image))
+        image_keys.append(image_key)
+
+        if ttl is not None:
+            ttls.append(ttl)
+
+    ttl = min(ttls) if ttls else None
+
+    features = region["features"]
+    areas = _get_zonal_info(features, layers, scale, image_keys, ttl, region.get('crs'))
+
+    for f, area in zip(features, areas):
+        yield {
+            "id": _get_feature_id(f),
+            "area_per_type": {id: zonal.format_groups(area[id]) for id in ids}
+        }
 
 
 def get_zonal_info_landuse_vs_legger(region, date_begin, date_end, scale, asset_type):
-    pass
+    """
+    Computes area per landuse and legger class combination (transition matrix), using a single
+    grouped reduction over combined class keys (landuse * 10 + legger).
+    :return: generator of zonal info per feature, area matrix with landuse classes as rows and
+    legger classes as columns
+    """
+    landuse, landuse_key, ttl = _get_zonal_image_landuse(region, date_begin, date_end, asset_type)
+    legger = _get_legger_image(date_begin)
 
+    transitions = landuse.multiply(10).add(legger).int()
+    image_key = ['landuse-vs-legger', landuse_key, _get_legger_image_id(date_begin)]
 
-def get_zonal_info_ndvi(region, date_begin, date_end, scale, asset_type):
-    pass
+    classes = sorted(int(c) for c in legend_remap.keys())
 
+    features = region["features"]
+    areas = _get_zonal_info(features, [('groups', transitions)], scale, image_key, ttl, region.get('crs'))
 
-def get_zonal_info_legger(region, date_begin, date_end, scale, asset_type):
-    features = ee.FeatureCollection(region["features"])
+    for f, area in zip(features, areas):
+        yield {
+            "id": _get_feature_id(f),
+            "area": zonal.format_transitions(area['groups'], classes)
+        }
 
-    image = _get_legger_image(date_begin)
 
-    info = _get_zonal_info(features, image, scale)
+def get_zonal_info_ndvi(region, date_begin, date_end, scale, asset_type):
+    """
+    Computes NDVI statistics per feature, for a daily mosaic or a composite of cloud-free images of a year
+    """
+    if asset_type == 'day':
+        image = _get_ndvi(date_begin, date_end, _get_region_geometry(region))
+        image_key = None
+    else:
+        ranking_region, bounds, ranking_key = _get_ndvi_ranking_region(region)
+        image = _get_ndvi_composite(ranking_region, date_begin, date_end, bounds)
+        image_key = [ndvi_composite_version, ranking_key,
+                     _get_cloud_filtering_method(bounds, date_begin, date_end)]
+
+    features = region["features"]
+    keys = [cache.make_key('zonal-info-ndvi', f['geometry'], region.get('crs'), asset_type, _to_key(date_begin),
+                           _to_key(date_end), image_key, scale) for f in features]
+
+    statistics = zonal.imap_cached(lambda chunk: _get_zonal_ndvi_statistics(chunk, image, scale), features, keys,
+                                   zonal_feature_cache, zonal_chunk_size, zonal_max_workers, zonal_feature_ttl_day)
+
+    for f, ndvi in zip(features, statistics):
+        yield {
+            "id": _get_feature_id(f),
+            "ndvi": ndvi
+        }
 
-    return info.getInfo()
+
+def get_zonal_info_legger(region, date_begin, date_end, scale, asset_type):
+    image, image_key, ttl = _get_zonal_image_legger(region, date_begin, date_end, asset_type)
+
+    return _get_zonal_info_single(region, image, scale, image_key, ttl)
 
 
 zonal_info = {
@@ -526,43 +970,238 @@ yearly_collections = {
 }
 
 
-def _get_zonal_timeseries(features, images, scale):
-    images = ee.ImageCollection(images)
-    image_times = ee.List(images.aggregate_array('system:time_start')) \
-        .map(to_date_time_string).getInfo()
+# maximum error of catalog footprints in meters
+catalog_footprint_error = 100
+
+# margin in degrees added to bounds tested against simplified footprints, exceeds catalog_footprint_error
+catalog_footprint_margin = 0.01
+
+
+def _get_catalog_footprint(footprint):
+    """
+    Returns the exterior ring of a simplified footprint, None if it is not a polygon without holes
+    """
+    if footprint['type'] != 'Polygon' or len(footprint['coordinates']) != 1:
+        return None
 
-    area = ee.Image.pixelArea().rename('area')
+    return [xy[:2] for xy in footprint['coordinates'][0]]
 
-    images = images.map(lambda i: area.addBands(i.rename('type')))
 
-    # for every input feature, compute area
-    def get_feature_info(f):
-        f = ee.Feature(f)
+def _fetch_catalog_images(collection):
+    """
+    Returns ids, times, footprints and the position in the collection of all images in a collection
+    :return: [{'id': ..., 'time': ..., 'bounds': [xmin, ymin, xmax, ymax], 'footprint': [[x, y], ...],
+    'order': ...}, ...]
+    """
 
-        reducer = ee.Reducer.sum().group(**{
-            "groupField": 1,
-            "groupName": 'type',
+    def get_image_info(i):
+        return ee.Feature(None, {
+            'index': i.get('system:index'),
+            'time': i.get('system:time_start'),
+            'bounds': i.geometry().bounds(),
+            'footprint': i.geometry().simplify(catalog_footprint_error)
         })
 
-        geom = f.geometry()
+    features = ee.ImageCollection(collection).map(get_image_info).getInfo()['features']
 
-        def reduce_image(i):
-            area = i.reduceRegion(reducer, geom, scale)
-            area = ee.Feature(None).set({
-                'area': ee.List(ee.Dictionary(area).get('groups'))
-            })
-            return area
+    return [{
+        'id': collection + '/' + f['properties']['index'],
+        'time': f['properties']['time'],
+        'bounds': geometry.get_bounds(f['properties']['bounds']),
+        'footprint': _get_catalog_footprint(f['properties']['footprint']),
+        'order': order
+    } for order, f in enumerate(features)]
 
-        info = images.map(reduce_image)
-        area = ee.List(info.aggregate_array("area"))
 
-        return {
-            "id": f.get('id'),
-            "area": area,
+def _fetch_catalog_update_time(collection):
+    return ee.data.getAsset(collection).get('updateTime')
+
+
+# yearly collections change about once a year, image lists are kept in memory and revalidated
+# against the collection update time
+image_catalog = catalog.Catalog(_fetch_catalog_images, _fetch_catalog_update_time,
+                                footprint_margin=catalog_footprint_margin)
+
+
+# zonal statistics of yearly images per feature and year, only missing years are computed
+# ZONAL_STORE is 'firestore' (default, shared by all instances) or the path of a local sqlite database
+zonal_store_location = os.environ.get('ZONAL_STORE', 'firestore')
+
+if zonal_store_location == 'firestore':
+    zonal_store = store.FirestoreZonalStore(firestore.Client, u'zonal-store')
+else:
+    zonal_store = store.ZonalStore(zonal_store_location)
+
+
+def _get_collection_images(collection, region, date_begin, date_end):
+    """
+    Returns ids and times of images in a collection, sorted by time
+    :return: [{'id': ..., 'time': ...}, ...]
+    """
+    images = get_image_collection(collection, region, date_begin, date_end)
+
+    rows = images.reduceColumns(ee.Reducer.toList(2), ['system:index', 'system:time_start']) \
+        .get('list').getInfo()
+
+    images = [{'id': collection + '/' + index, 'time': time} for index, time in rows]
+
+    return sorted(images, key=lambda i: i['time'])
+
+
+def _format_time(millis):
+    return datetime.utcfromtimestamp(millis / 1000.0).strftime('%Y-%m-%d %H:%M')
+
+
+def _get_stored_zonal_values(features, collection, periods, reduce, scale, crs=None, version=0):
+    """
+    Computes zonal statistics per period for every input feature. Results of immutable periods are
+    stored per feature and period, only periods missing from the store are computed. Chunks of
+    features and periods are computed concurrently.
+    :param features: list of GeoJSON features
+    :param collection: collection id, part of the store key
+    :param periods: list of (period, image, immutable), periods without image are returned as gaps
+    :param reduce: function(features, image), returns statistics per feature
+    :param scale:
+    :param crs: crs of the feature geometries (GeoJSON crs of the region)
+    :param version: version of the computation, part of the store key
+    :return: per feature, a list of statistics per period (None for gaps)
+    """
+    geometries = [cache.make_key(f['geometry'], crs) if crs else cache.make_key(f['geometry']) for f in features]
+
+    values = zonal_store.get_many(geometries, collection, scale, [period for period, image, immutable in periods],
+                                  version)
+
+    # features missing per period, computed in chunks
+    work = []
+    for period, image, immutable in periods:
+        if image is None:
+            continue
+
+        missing = [(g, f) for g, f in zip(geometries, features) if (g, period) not in values]
+
+        for chunk in zonal.iter_chunks(missing, zonal_chunk_size):
+            work.append((period, image, immutable, chunk))
+
+    def compute(work_items):
+        period, image, immutable, chunk = work_items[0]
+
+        results = reduce([f for g, f in chunk], image)
+        results = {g: result for (g, f), result in zip(chunk, results)}
+
+        if immutable:
+            zonal_store.put_many(collection, period, scale, results, version)
+
+        return [(period, results)]
+
+    for period, results in zonal.imap_chunks(compute, work, 1, zonal_max_workers):
+        for g, result in results.items():
+            values[(g, period)] = result
+
+    return [[values.get((g, period)) for period, image, immutable in periods] for g in geometries]
+
+
+def _get_zonal_timeseries(features, collection, images, scale, crs=None):
+    """
+    Computes area per type per image for every input feature. Areas are stored per feature and image,
+    only images missing from the store are computed.
+    :param features: list of GeoJSON features
+    :param collection: image collection id
+    :param images: list of {'id': ..., 'time': ...}, images without id are returned as gaps
+    :param scale:
+    :return:
+    """
+    periods = []
+    for i in images:
+        year = str(datetime.utcfromtimestamp(i['time'] / 1000.0).year)
+
+        # a yearly collection may contain multiple images per year
+        if i['id']:
+            periods.append((year + '/' + i['id'].split('/')[-1], ee.Image(i['id']), True))
+        else:
+            periods.append((year, None, True))
+
+    def reduce(chunk, image):
+        return [area['groups'] for area in _get_zonal_areas(chunk, [('groups', image)], scale)]
+
+    areas = _get_stored_zonal_values(features, collection, periods, reduce, scale, crs)
+
+    image_times = [_format_time(i['time']) for i in images]
+
+    info = []
+    for f, area in zip(features, areas):
+        info.append({
+            "id": _get_feature_id(f),
+            "area": [a or [] for a in area],
             "times": image_times
-        }
+        })
+
+    return info
+
 
-    return features.toList(5000).map(get_feature_info)
+ndvi_statistics = ['mean', 'p10', 'p50', 'p90', 'count']
+
+
+def _get_zonal_ndvi_statistics(features, image, scale):
+    """
+    Computes NDVI mean, percentiles and valid pixel count for a chunk of features in a single
+    reduceRegions() call
+    :param features: list of GeoJSON features
+    :param image: NDVI image
+    :param scale:
+    :return: list of statistics per feature
+    """
+    reducer = ee.Reducer.mean() \
+        .combine(ee.Reducer.percentile([10, 50, 90]), sharedInputs=True) \
+        .combine(ee.Reducer.count(), sharedInputs=True)
+
+    statistics = ee.Image(image).rename('ndvi') \
+        .reduceRegions(ee.FeatureCollection(features), reducer, scale) \
+        .select(ndvi_statistics, None, False)
+
+    statistics = statistics.getInfo()['features']
+
+    return [{k: f['properties'].get(k) for k in ndvi_statistics} for f in statistics]
+
+
+# increase when the selection of images for NDVI composites changes, stored statistics of other versions
+# are not used
+ndvi_composite_version = 2
+
+
+def _get_ndvi_ranking_region(region):
+    """
+    Returns geometry, bounds (longitude and latitude) and key of the region over which images are ranked
+    by clouds for NDVI composites. This is the footprint if defined, so that statistics of a feature do not
+    depend on the other features of a request, otherwise the region itself.
+    """
+    footprint = _get_region_footprint(region)
+
+    if footprint:
+        return ee.Geometry.Rectangle(footprint), footprint, footprint
+
+    return _get_region_geometry(region), geometry.get_lon_lat_bounds(region), _get_region_key(region)
+
+
+def _get_cloud_filtering_method(bounds, date_begin, date_end):
+    """
+    Returns how get_satellite_images() selects cloud-free images, 'quality-index' if stored quality
+    scores cover the region and period, otherwise 'quality-score' (computed by EE)
+    """
+    if bounds and _get_stored_clean_image_ids(bounds, date_begin, date_end) is not None:
+        return 'quality-index'
+
+    return 'quality-score'
+
+
+def _get_ndvi_composite(region, date_begin, date_end, bounds=None):
+    """
+    Computes median NDVI of cloud-filtered images
+    :param bounds: region bounds in longitude and latitude, see get_satellite_images()
+    """
+    images = get_satellite_images(region, date_begin, date_end, True, bounds)
+    image = ee.Image(images.median()).divide(10000)
+
+    return image.normalizedDifference(['nir', 'red'])
 
 
 legend_remap = {
@@ -620,60 +1259,154 @@ legend_remap = {
 }
 
 
-def get_zonal_timeseries_landuse(region, date_begin, date_end, scale):
-    features = ee.FeatureCollection(region["features"])
-    # Add empty image for 2012
-    empty = ee.Image().set("system:time_start", ee.Date("2012-06-01").millis()).rename("remapped")
-    collection = yearly_collections["landuse"]
-    images = get_image_collection(collection, features.geometry(), date_begin, date_end) \
-        .merge(ee.ImageCollection([empty])).sort("system:time_start")
-    features = ee.FeatureCollection(region["features"])
+def _format_zonal_timeseries(info, format):
+    """
+    Formats area per type per image as ECharts series per feature, or as columnar arrays
+    :param info: output of _get_zonal_timeseries()
+    :param format: 'echarts' or 'columnar'
+    :return:
+    """
+    classes = sorted(int(c) for c in legend_remap.keys())
 
-    image = _get_landuse(features.geometry(), date_begin, date_end)
+    values = zonal.pivot_groups([feature_data['area'] for feature_data in info], classes)
 
-    info = _get_zonal_info(features, image, scale)
+    times = info[0]['times'] if info else []
+
+    if format == 'columnar':
+        return {
+            "ids": [feature_data['id'] for feature_data in info],
+            "times": times,
+            "classes": classes,
+            "names": [legend_remap[str(c)]["name"] for c in classes],
+            "area": zonal.fill_gaps(values, None)
+        }
+
+    data = zonal.fill_gaps(values, "-")
 
-    info = _get_zonal_timeseries(features, images, scale)
-    info = info.getInfo()
     timeseries = []
     for i, feature_data in enumerate(info):
+        series = []
+        for k, c in enumerate(classes):
+            series.append({"name": legend_remap[str(c)]["name"], "type": "line", "data": data[i][k],
+                           "color": legend_remap[str(c)]["color"]})
+
         timeseries.append({
-            "series": []
+            "series": series,
+            "xAxis": {
+                "data": feature_data["times"]
+            },
+            "yAxis": {
+                "type": "value"
+            }
         })
-        for j in range(1, 7, 1):
-            timeseries[i]["series"].append({"name": legend_remap[str(j)]["name"], "type": "line", "data": [],
-                                            "color": legend_remap[str(j)]["color"]})
-
-        timeseries[i]["xAxis"] = {
-            "data": feature_data["times"]
-        }
-        timeseries[i]["yAxis"] = {
-            "type": "value"
-        }
-        for a in feature_data['area']:
-            for k in range(1, 7, 1):
-                val = next((item for item in a if item["type"] == k), None)
-                if not val:
-                    timeseries[i]["series"][k - 1]["data"].append("-")
-                else:
-                    #     item = d.get("type", None) == str(k)
-                    timeseries[i]["series"][k - 1]["data"].append(val.get("sum"))
 
     return timeseries
 
 
-def get_zonal_timeseries_landuse_vs_legger(region, date_begin, date_end, scale):
-    pass
+def _to_millis(t):
+    return int((t - datetime(1970, 1, 1)).total_seconds() * 1000)
+
 
+def get_zonal_timeseries_landuse(region, date_begin, date_end, scale, format, period):
+    """
+    :param date_begin: datetime
+    :param date_end: datetime
+    """
+    features = ee.FeatureCollection(region["features"])
+    collection = yearly_collections["landuse"]
 
-def get_zonal_timeseries_ndvi(region, date_begin, date_end, scale):
+    # only images in the requested range are reduced
+    images = _get_collection_images(collection, features.geometry(), _to_millis(date_begin), _to_millis(date_end))
+
+    # Add empty image for 2012, if requested
+    empty_time = datetime(2012, 6, 1)
+    if date_begin <= empty_time < date_end:
+        empty = {'id': None, 'time': _to_millis(empty_time)}
+        images = sorted(images + [empty], key=lambda i: i['time'])
+
+    info = _get_zonal_timeseries(region["features"], collection, images, scale, region.get('crs'))
+
+    return _format_zonal_timeseries(info, format)
+
+
+def get_zonal_timeseries_landuse_vs_legger(region, date_begin, date_end, scale, format, period):
     pass
 
 
-def get_zonal_timeseries_legger(region, date_begin, date_end, scale):
+def get_zonal_timeseries_ndvi(region, date_begin, date_end, scale, format, period):
+    """
+    Computes NDVI statistics per feature for monthly or seasonal composites. Composites are computed
+    concurrently, statistics of past periods are stored per feature and period.
+    :param date_begin: datetime
+    :param date_end: datetime
+    :param period: 'month' or 'season'
+    """
+    features = region["features"]
+    ranking_region, bounds, ranking_key = _get_ndvi_ranking_region(region)
+
+    # no Sentinel-2 images before its launch
+    date_begin = max(date_begin, datetime(2015, 6, 1))
+
+    # images are still added for recent periods
+    date_complete = datetime.utcnow() - timedelta(days=7)
+
+    # statistics are stored per region used to rank images and per method used to select images
+    collection = 'ndvi-{0}/{1}'.format(period, cache.make_key(ranking_key))
+
+    times = []
+    periods = []
+    for begin, end in zonal.get_periods(date_begin, date_end, period):
+        image = _get_ndvi_composite(ranking_region, _to_millis(begin), _to_millis(end), bounds)
+        method = _get_cloud_filtering_method(bounds, _to_millis(begin), _to_millis(end))
+
+        times.append(begin.strftime('%Y-%m-%d'))
+        periods.append((times[-1] + '/' + method, image, end <= date_complete))
+
+    def reduce(chunk, image):
+        return _get_zonal_ndvi_statistics(chunk, image, scale)
+
+    statistics = _get_stored_zonal_values(features, collection, periods, reduce, scale, region.get('crs'),
+                                          ndvi_composite_version)
+
+    # (feature, statistic, period)
+    values = [[[(s or {}).get(k) for s in feature_statistics] for k in ndvi_statistics]
+              for feature_statistics in statistics]
+
+    if format == 'columnar':
+        return {
+            "ids": [_get_feature_id(f) for f in features],
+            "times": times,
+            "statistics": ndvi_statistics,
+            "ndvi": values
+        }
+
+    timeseries = []
+    for feature_values in values:
+        series = []
+        for k, data in zip(ndvi_statistics, feature_values):
+            series.append({"name": k, "type": "line", "data": ["-" if v is None else v for v in data]})
+
+        timeseries.append({
+            "series": series,
+            "xAxis": {
+                "data": times
+            },
+            "yAxis": {
+                "type": "value"
+            }
+        })
+
+    return timeseries
+
+
+def get_zonal_timeseries_legger(region, date_begin, date_end, scale, format, period):
     pass
 
 
+zonal_timeseries_formats = ['echarts', 'columnar']
+
+zonal_timeseries_periods = ['month', 'season']
+
 zonal_timeseries = {
     'landuse': get_zonal_timeseries_landuse,
     'landuse-vs-legger': get_zonal_timeseries_landuse_vs_legger,
@@ -685,6 +1418,12 @@ modes = ['daily', 'yearly']
 
 asset_types = ['day', 'year']
 
+# EE map ids (tile tokens) expire after a few hours, keep urls well within that
+map_url_cache = cache.TTLCache(maxsize=512, ttl=60 * 60)
+
+# identical concurrent requests share a single EE round trip
+requests_in_flight = singleflight.SingleFlight()
+
 
 def get_image_url(image):
     map_id = ee.Image(image).getMapId()
@@ -697,6 +1436,22 @@ def get_image_url(image):
     return url
 
 
+def _get_export_url(id, region, date_begin, date_end, vis, asset_type, scale):
+    image = exports[id](region, date_begin, date_end, vis, asset_type)
+
+    format = 'geotiff'
+    if id == 'satellite':
+        format = 'png'
+
+    url = image.getDownloadURL({
+        "format": format,
+        "name": id + "_" + date_begin + "_" + date_end,
+        "scale": scale,
+        "region": json.dumps(region)})
+
+    return url
+
+
 @app.route('/map/<string:id>/export/', methods=['POST'])
 @flask_cors.cross_origin()
 def export_map(id):
@@ -733,23 +1488,25 @@ def export_map(id):
     if 'scale' in j:
         scale = j['scale']
 
-    image = exports[id](region, date_begin, date_end, vis, asset_type)
-
-    format = 'geotiff'
-    if id == 'satellite':
-        format = 'png'
+    key = cache.make_key('export', id, j['dateBegin'], j.get('dateEnd'), vis or {}, region, scale, asset_type)
 
-    url = image.getDownloadURL({
-        "format": format,
-        "name": id + "_" + date_begin + "_" + date_end,
-        "scale": scale,
-        "region": json.dumps(region)})
+    url = requests_in_flight.do(key, _get_export_url, id, region, date_begin, date_end, vis, asset_type, scale)
 
     results = {'url': url}
 
     return jsonify(results)
 
 
+def _get_map_url(key, id, region, date_begin, date_end, vis):
+    image = maps[id](region, date_begin, date_end, vis)
+
+    url = get_image_url(image)
+
+    map_url_cache.set(key, url)
+
+    return url
+
+
 @app.route('/map/<string:id>/', methods=['POST'])
 @flask_cors.cross_origin()
 def get_map(id):
@@ -771,28 +1528,47 @@ def get_map(id):
     if 'vis' in json:
         vis = json['vis']
 
-    image = maps[id](region, date_begin, date_end, vis)
+    # compute key before vis is extended with default parameters
+    key = cache.make_key('map', id, json['dateBegin'], json.get('dateEnd'), vis or {}, region)
 
-    url = get_image_url(image)
+    url = map_url_cache.get(key)
+    if url is None:
+        url = requests_in_flight.do(key, _get_map_url, key, id, region, date_begin, date_end, vis)
 
     results = {'url': url}
 
     return jsonify(results)
 
 
-@app.route('/map/<string:id>/zonal-info/', methods=['POST'])
-@flask_cors.cross_origin()
-def get_map_zonal_info(id):
+def _get_zonal_info_list(fn, *args):
+    info = fn(*args) or []
+
+    return list(info)
+
+
+def _to_ndjson(items):
     """
-    Returns zonal statistics per input feature (region)
+    Yields one JSON line per item. An error after the response has started ends the stream with an error line,
+    so that clients can tell a stream which was cut short from a complete one.
     """
+    try:
+        for item in items:
+            yield json.dumps(item) + '\n'
+    except Exception as e:
+        traceback.print_exc()
 
-    if id not in ['landuse', 'ndvi', 'landuse-vs-legger', 'legger']:
-        return 'Error: zonal statistics for {0} is not supported yet' \
-            .format(id)
+        yield json.dumps({'error': {'type': 'UnexpectedException', 'message': str(e)}}) + '\n'
+
+
+def _is_stream_request():
+    return request.args.get('stream') == '1' or \
+        request.accept_mimetypes.best_match(['application/json', 'application/x-ndjson']) == 'application/x-ndjson'
 
-    json = request.get_json()
 
+def _get_zonal_request_args(json):
+    """
+    Parses region, dates, scale and asset type of a zonal statistics request
+    """
     if 'assetType' in json:
         asset_type = json['assetType']
     else:
@@ -817,11 +1593,77 @@ def get_map_zonal_info(id):
 
     scale = json['scale']
 
-    info = zonal_info[id](region, date_begin, date_end, scale, asset_type)
+    return region, date_begin, date_end, scale, asset_type
+
+
+def _get_zonal_info_response(key, fn, *args):
+    # stream one JSON line per feature, as soon as its chunk is computed
+    if _is_stream_request():
+        info = iter(fn(*args) or [])
+
+        # the first chunk is computed before the response starts, early errors are returned as errors
+        first = next(info, None)
+        if first is not None:
+            info = itertools.chain([first], info)
+
+        return Response(stream_with_context(_to_ndjson(info)), mimetype='application/x-ndjson')
+
+    info = requests_in_flight.do(key, _get_zonal_info_list, fn, *args)
 
     return jsonify(info)
 
 
+@app.route('/map/<string:id>/zonal-info/', methods=['POST'])
+@flask_cors.cross_origin()
+def get_map_zonal_info(id):
+    """
+    Returns zonal statistics per input feature (region)
+    """
+
+    if id not in ['landuse', 'ndvi', 'landuse-vs-legger', 'legger']:
+        return 'Error: zonal statistics for {0} is not supported yet' \
+            .format(id)
+
+    json = request.get_json()
+
+    region, date_begin, date_end, scale, asset_type = _get_zonal_request_args(json)
+
+    key = cache.make_key('zonal-info', id, json.get('dateBegin'), json.get('dateEnd'), region, scale, asset_type)
+
+    return _get_zonal_info_response(key, zonal_info[id], region, date_begin, date_end, scale, asset_type)
+
+
+@app.route('/map/zonal-info/', methods=['POST'])
+@flask_cors.cross_origin()
+def get_map_zonal_info_layers():
+    """
+    Returns zonal statistics per input feature (region) for multiple layers, computed in one pass
+    """
+
+    json = request.get_json()
+
+    ids = json.get('layers')
+
+    if not isinstance(ids, list) or not ids:
+        return 'Error: layers should be a non-empty list of layer ids: {0}'.format(', '.join(sorted(zonal_images)))
+
+    for id in ids:
+        if not isinstance(id, str) or id not in zonal_images:
+            return 'Error: zonal statistics for {0} is not supported in combination with other layers' \
+                .format(id)
+
+    if len(set(ids)) != len(ids):
+        return 'Error: layers should not contain duplicates'
+
+    region, date_begin, date_end, scale, asset_type = _get_zonal_request_args(json)
+
+    key = cache.make_key('zonal-info-layers', ids, json.get('dateBegin'), json.get('dateEnd'), region, scale,
+                         asset_type)
+
+    return _get_zonal_info_response(key, get_zonal_info_layers, ids, region, date_begin, date_end, scale,
+                                    asset_type)
+
+
 @app.route('/map/<string:id>/zonal-timeseries/', methods=['POST'])
 @flask_cors.cross_origin()
 def get_map_zonal_timeseries(id):
@@ -829,35 +1671,157 @@ def get_map_zonal_timeseries(id):
     Returns zonal timeseries per input feature (region)
     """
 
-    if id != 'landuse':
-        return 'Error: zonal timeseries for {0} is not supported yet' \
-            .format(id)
+    if id not in ['landuse', 'ndvi']:
+        return 'Error: zonal timeseries for {0} is not supported yet' \
+            .format(id)
+
+    json = request.get_json()
+
+    region = json['region']
+
+    date_begin = datetime(2000, 1, 1)
+    date_end = datetime.now()
+
+    if 'dateBegin' in json:
+        date_begin = datetime.strptime(json['dateBegin'], '%Y-%m-%d')
+
+    if 'dateEnd' in json:
+        date_end = datetime.strptime(json['dateEnd'], '%Y-%m-%d')
+
+    scale = json['scale']
+
+    format = json.get('format', 'echarts')
+    if format not in zonal_timeseries_formats:
+        raise ValueError('Error: format {0} is not supported, only echarts or columnar available'
+                         .format(format))
+
+    period = json.get('period', 'month')
+    if period not in zonal_timeseries_periods:
+        raise ValueError('Error: period {0} is not supported, only month or season available'
+                         .format(period))
+
+    info = zonal_timeseries[id](region, date_begin, date_end, scale, format, period)
+
+    return jsonify(info)
+
+
+# Sentinel-2 acquisitions per MGRS tile, refreshed daily by cron
+acquisition_index_cache = cache.TTLCache(maxsize=1, ttl=60 * 60)
+
+# index is not used if it was not refreshed recently, EE is queried instead
+acquisition_index_max_age = timedelta(days=2)
+
+
+def _get_acquisition_index():
+    index = acquisition_index_cache.get('index')
+
+    if index is None:
+        db = firestore.Client()
+
+        tiles = [tile.to_dict() for tile in db.collection(u's2-acquisition-index').stream()]
+
+        updated = min([tile['updated'] for tile in tiles] or [0])
+
+        index = acquisitions.AcquisitionIndex(tiles, updated)
+
+        acquisition_index_cache.set('index', index)
+
+    return index
+
+
+@app.route('/update_acquisition_index/', methods=['GET'])
+@flask_cors.cross_origin()
+def update_acquisition_index():
+    """
+    Stores acquisition times, cloud percentages and footprints of Sentinel-2 images per MGRS tile,
+    used to answer /times/daily requests without EE calls. Footprints are stored as convex hulls, a
+    few vertices each, these contain the footprint so that no acquisitions are missed.
+    """
+    aoi = ee.FeatureCollection('users/gdonchyts/vegetation-monitor-aoi').geometry()
+
+    date_end = datetime.today() + timedelta(days=1)
+    date_begin = date_end - timedelta(days=370)
+
+    images = ee.ImageCollection('COPERNICUS/S2') \
+        .filterDate(ee.Date(date_begin), ee.Date(date_end)) \
+        .filterBounds(aoi)
+
+    def get_image_info(i):
+        return ee.Feature(None, {
+            'tile': i.get('MGRS_TILE'),
+            'time': i.get('system:time_start'),
+            'cloud': i.get('CLOUDY_PIXEL_PERCENTAGE'),
+            'bounds': i.geometry().bounds(),
+            'footprint': i.geometry().convexHull(100)
+        })
+
+    images = images.map(get_image_info).getInfo()['features']
+
+    updated = _to_millis(datetime.utcnow())
+
+    tiles = {}
+    for i in sorted(images, key=lambda i: i['properties']['time']):
+        p = i['properties']
+
+        tile = tiles.setdefault(p['tile'], {'tile': p['tile'], 'times': [], 'cloud': [], 'bounds': [],
+                                            'footprints': [], 'footprint_sizes': [], 'updated': updated})
+        tile['times'].append(p['time'])
+        tile['cloud'].append(p['cloud'])
+        tile['bounds'].extend(geometry.get_bounds(p['bounds']))
+
+        # Firestore does not store nested arrays, rings are flattened
+        ring = p['footprint']['coordinates'][0]
+        tile['footprints'].extend(c for xy in ring for c in xy[:2])
+        tile['footprint_sizes'].append(len(ring))
+
+    db = firestore.Client()
+    index_ref = db.collection(u's2-acquisition-index')
+
+    for tile in tiles.values():
+        index_ref.document(tile['tile']).set(tile)
+
+    acquisition_index_cache.clear()
+
+    return 'DONE'
+
+
+def _get_map_times_daily(id, region):
+    # take images for one year from now
+    date_end = datetime.today()
+    date_begin = date_end - timedelta(days=365)
+
+    bounds = geometry.get_lon_lat_bounds(region)
 
-    json = request.get_json()
+    image_times = None
 
-    region = json['region']
+    # the index is an optimization, EE is queried on any error while loading or querying it
+    try:
+        index = _get_acquisition_index() if bounds else None
 
-    date_begin = ee.Date("2000-01-01")
-    date_end = ee.Date("2019-01-01")
+        if index and datetime.utcnow() - datetime.utcfromtimestamp(index.updated / 1000.0) < acquisition_index_max_age:
+            image_times = index.query(bounds, _to_millis(date_begin), _to_millis(date_end), 10)
+            image_times = [datetime.utcfromtimestamp(t / 1000.0) for t in image_times]
+    except Exception:
+        image_times = None
 
-    # if 'dateBegin' in json:
-    #     date_begin = ee.Date(json['dateBegin'])
-    #
-    # if 'dateEnd' in json:
-    #     date_end = ee.Date(json['dateEnd'])
+    if image_times is None:
+        image_times = _get_map_times_daily_ee(region, date_begin, date_end)
 
-    scale = json['scale']
+    image_dates = list(sorted(set(map(lambda x: x.strftime('%Y-%m-%d'), image_times))))
 
-    info = zonal_timeseries[id](region, date_begin, date_end, scale)
+    image_info_list = []
 
-    return jsonify(info)
+    for time in image_dates:
+        image_info_list.append({
+            "date": time,
+            "dateFormat": 'YYYY-MM-DD',
+            "type": "instance"
+        })
 
+    return image_info_list
 
-def _get_map_times_daily(id, region):
-    # take images for one year from now
-    date_end = datetime.today()
-    date_begin = date_end - timedelta(days=365)
 
+def _get_map_times_daily_ee(region, date_begin, date_end):
     # HACK: return least cloudy images using metadata
     images = ee.ImageCollection('COPERNICUS/S2') \
         .filterDate(ee.Date(date_begin), ee.Date(date_end)) \
@@ -876,31 +1840,25 @@ def _get_map_times_daily(id, region):
     image_times = ee.List(images.aggregate_array('system:time_start')) \
         .map(to_date_time_string).getInfo()
 
-    image_times = map(lambda x: datetime.strptime(x, '%Y-%m-%d %H:%M'), image_times)
-    image_dates = list(sorted(set(map(lambda x: x.strftime('%Y-%m-%d'), image_times))))
-
-    image_info_list = []
-
-    for time in image_dates:
-        image_info_list.append({
-            "date": time,
-            "dateFormat": 'YYYY-MM-DD',
-            "type": "instance"
-        })
-
-    return image_info_list
+    return map(lambda x: datetime.strptime(x, '%Y-%m-%d %H:%M'), image_times)
 
 
 def _get_map_times_yearly(id, region):
     date_begin = datetime(2000, 1, 1, 0, 0, 0)
     date_end = datetime.now()
 
-    images = get_image_collection(yearly_collections[id], region, date_begin, date_end)
+    bounds = geometry.get_lon_lat_bounds(region)
 
-    image_times = ee.List(images.aggregate_array('system:time_start')) \
-        .map(to_date_time_string).getInfo()
+    if bounds:
+        images = image_catalog.find(yearly_collections[id], bounds, _to_millis(date_begin), _to_millis(date_end))
+        image_times = map(lambda i: datetime.utcfromtimestamp(i['time'] / 1000.0), images)
+    else:
+        images = get_image_collection(yearly_collections[id], region, date_begin, date_end)
+
+        image_times = ee.List(images.aggregate_array('system:time_start')) \
+            .map(to_date_time_string).getInfo()
 
-    image_times = map(lambda x: datetime.strptime(x, '%Y-%m-%d %H:%M'), image_times)
+        image_times = map(lambda x: datetime.strptime(x, '%Y-%m-%d %H:%M'), image_times)
 
     image_start_dates = list(map(lambda t: datetime(t.year, 1, 1), image_times))
     image_end_dates = list(map(lambda t: datetime(t.year + 1, 1, 1), image_start_dates))
@@ -1407,8 +2365,160 @@ def get_image_by_id():
     return jsonify(url)
 
 
-def _compound_tile_index(tx, ty):
-    return tx * 100000 + ty
+# 'records': one s2-tile-cache document per tile and image, 'tiles': one s2-tile-cache-tiles document per tile
+tile_cache_layout = os.environ.get('TILE_CACHE_LAYOUT', 'records')
+
+
+def _read_tile_images(db):
+    """
+    Returns all tile image records, from the configured layout
+    """
+    if tile_cache_layout == 'tiles':
+        tiles = db.collection(u's2-tile-cache-tiles').stream()
+
+        return [tile_image for t in tiles for tile_image in tile_cache.decode_tile(t.to_dict())]
+
+    return read_tile_image_records(db)
+
+
+def read_tile_image_records(db):
+    """
+    Returns all tile image records of s2-tile-cache, written by update_cloudfree_tile_images
+    """
+    tile_images = db.collection(u's2-tile-cache').select(['tx', 'ty', 'image_time', 'image_id', 'quality_score'])
+
+    return [t.to_dict() for t in tile_images.stream()]
+
+
+def write_compact_tile_cache(db, tile_images):
+    """
+    Writes one s2-tile-cache-tiles document per tile, removes documents of tiles without images
+    """
+    tiles_ref = db.collection(u's2-tile-cache-tiles')
+    tiles = tile_cache.group_tiles(tile_images)
+
+    with bulk_writer.BulkWriter(db, retry_exceptions=firestore_retry_exceptions) as writer:
+        for key, tile in tiles.items():
+            writer.set(tiles_ref.document(key), tile)
+
+        for t in tiles_ref.list_documents():
+            if t.id not in tiles:
+                writer.delete(t)
+
+    return len(tiles)
+
+
+# acquisition days per z10 tile, loaded from s2-tile-cache at startup and after each cron run
+tile_times_index_cache = cache.TTLCache(maxsize=1, ttl=6 * 60 * 60)
+
+# seconds before an expired index is reloaded again, if its reload failed
+index_reload_retry = 10 * 60
+
+
+def _reload_index(name, load):
+    try:
+        requests_in_flight.do(name, load)
+    except Exception:
+        traceback.print_exc()
+
+
+def _get_index(index_cache, name, load):
+    """
+    Returns an in-memory index, loaded on first use, concurrent requests share a single load. An expired
+    index is returned while it is reloaded in the background, so that requests do not wait for a reload.
+    :param index_cache: cache of the index, the index is stored as 'index'
+    :param name: key of the load in requests_in_flight
+    :param load: function(), loads the index and stores it in index_cache
+    """
+    index, fresh = index_cache.get_stale('index')
+
+    if index is None:
+        return requests_in_flight.do(name, load)
+
+    if not fresh:
+        # keep the expired index until the reload stores a new one, a failed reload is retried later
+        index_cache.set('index', index, ttl=index_reload_retry)
+
+        threading.Thread(target=_reload_index, args=(name, load), daemon=True).start()
+
+    return index
+
+
+def _load_tile_times_index(tile_images=None):
+    """
+    :param tile_images: tile image records, read from s2-tile-cache if not defined
+    """
+    if tile_images is None:
+        tile_images = _read_tile_images(firestore.Client())
+
+    index = tile_cache.TileTimesIndex(tile_images)
+
+    tile_times_index_cache.set('index', index)
+
+    return index
+
+
+def get_tile_times_index():
+    """
+    Returns the in-memory index of s2-tile-cache, see _get_index()
+    """
+    return _get_index(tile_times_index_cache, 'tile_times_index', _load_tile_times_index)
+
+
+# quality scores of all images per z10 tile, loaded from s2-image-quality after each cron run
+image_quality_index_cache = cache.TTLCache(maxsize=1, ttl=6 * 60 * 60)
+
+
+def _load_image_quality_index():
+    db = firestore.Client()
+    state = db.collection(u's2-tile-cache-state').document(u'state').get().to_dict() or {}
+
+    if state.get('quality_time_begin') is None or state.get('quality_job') is None:
+        # no full update with quality scores yet
+        index = tile_cache.ImageQualityIndex([], 0, 0)
+    else:
+        time_begin = max(state['quality_time_begin'], state['time_end'] - tile_cache_days * tile_cache.day_millis)
+
+        # documents of a running full job are written under its own id, see _update_image_quality()
+        tiles = db.collection(u's2-image-quality').where(u'job', u'==', state['quality_job']).stream()
+        tiles = [t.to_dict() for t in tiles]
+
+        index = tile_cache.ImageQualityIndex(tiles, time_begin, state['time_end'])
+
+    image_quality_index_cache.set('index', index)
+
+    return index
+
+
+def get_image_quality_index():
+    """
+    Returns the in-memory index of s2-image-quality, see _get_index()
+    """
+    return _get_index(image_quality_index_cache, 'image_quality_index', _load_image_quality_index)
+
+
+def _get_stored_clean_image_ids(bounds, date_begin, date_end):
+    """
+    Returns system:index of mostly cloud-free images using stored quality scores
+    :return: list of image ids, None if stored scores do not cover the region or period
+    """
+    time_begin = _parse_date(date_begin)
+    time_end = _parse_date(date_end)
+
+    if time_begin is None or time_end is None:
+        return None
+
+    try:
+        index = get_image_quality_index()
+    except google_exceptions.GoogleAPIError:
+        return None
+
+    image_ids = index.select(bounds, _to_millis(time_begin), _to_millis(time_end), cloud_frequency_nl)
+
+    if image_ids is None:
+        return None
+
+    return [id.split('/')[-1] for id in image_ids]
 
 
 @app.route('/get_times_by_tiles/', methods=['POST'])
@@ -1416,24 +2526,56 @@ def _compound_tile_index(tx, ty):
 def get_times_by_tiles():
     json = request.get_json()
 
-    db = firestore.Client()
-    tile_images_ref = db.collection(u's2-tile-cache')
-
     tilesMin = json['tilesMin']
     tilesMax = json['tilesMax']
     print('tilesMin: ', tilesMin)
     print('tilesMax: ', tilesMax)
 
+    times = None
+
+    # the index is an optimization, Firestore is queried on any error while loading or querying it
+    try:
+        index = get_tile_times_index()
+
+        if index:
+            times = index.query(tilesMin, tilesMax)
+    except Exception:
+        traceback.print_exc()
+
+    if times is None:
+        times = _get_times_by_tiles_firestore(tilesMin, tilesMax)
+
+    date_list = []
+    for time in times:
+        date_list.append({
+            "date": datetime.utcfromtimestamp(time/1000.0).strftime('%Y-%m-%d'),
+            "dateFormat": 'YYYY-MM-DD',
+            "type": "instance"
+        })
+
+    return jsonify(date_list)
+
+
+def _get_times_by_tiles_firestore(tiles_min, tiles_max):
+    db = firestore.Client()
+
+    if tile_cache_layout == 'tiles':
+        # one document per tile
+        tiles = tile_cache.query_tiles(db.collection(u's2-tile-cache-tiles'), tiles_min, tiles_max, ['times'])
+
+        times = set()
+        for tile in tiles:
+            times.update(tile_cache.decode_times(tile['times']))
+
+        return list(times)
+
+    tile_images_ref = db.collection(u's2-tile-cache')
+
     tile_images = {}
     # times = set()
-    txty_min = _compound_tile_index(tilesMin['tx'], tilesMin['ty'])
-    txty_max = _compound_tile_index(tilesMax['tx'], tilesMax['ty'])
 
-    tile_images_query = tile_images_ref.where(u'txty', u'>=', txty_min).where(u'txty', u'<=', txty_max) \
-        .select(['image_time', 'image_id'])
-
-    for tile_image in tile_images_query.stream():
-        tile_image = tile_image.to_dict()
+    # one query per tile column, reads only documents within the tile rectangle
+    for tile_image in tile_cache.query_tiles(tile_images_ref, tiles_min, tiles_max, ['image_time', 'image_id']):
         tile_images[tile_image['image_time']] = {
             'id': tile_image['image_id'],
             'time': tile_image['image_time']
@@ -1443,58 +2585,365 @@ def get_times_by_tiles():
 
     # times = list(times)
 
-    times = list(tile_images.keys())
+    return list(tile_images.keys())
 
-    date_list = []
-    for time in times:
-        date_list.append({
-            "date": datetime.fromtimestamp(time/1000.0).strftime('%Y-%m-%d'),
-            "dateFormat": 'YYYY-MM-DD',
-            "type": "instance"
-        })
 
-    return jsonify(date_list)
+# Firestore errors for which batched writes are retried
+firestore_retry_exceptions = (
+    google_exceptions.Aborted,
+    google_exceptions.DeadlineExceeded,
+    google_exceptions.ServiceUnavailable
+)
 
+# images acquired during the last year are cached per z10 tile
+tile_cache_days = 365
 
-@app.route('/update_cloudfree_tile_images/', methods=['GET'])
-@flask_cors.cross_origin()
-def update_cloudfree_tile_images():
-    aoi = ee.FeatureCollection('users/gdonchyts/vegetation-monitor-aoi').geometry()
-    tiles = ee.FeatureCollection('users/gdonchyts/vegetation-monitor-tiles-z10')  # .limit(2)
+# images appear in EE some days after acquisition, incremental updates recompute this period again
+tile_cache_overlap = timedelta(days=5)
+
+# tiles are computed in chunks, evaluated concurrently, completed chunks are recorded in the job document
+tile_cache_chunk_size = 20
+tile_cache_max_workers = 4
+
+# no new chunks are started after this time, stays below the gunicorn worker timeout (300s)
+tile_cache_time_budget = 200
+
+# unfinished jobs are resumed, a job which is older or failed more often is abandoned and a new job is started
+tile_cache_job_max_age = timedelta(days=2)
+tile_cache_job_max_failures = 10
+
+tile_cache_tiles = 'users/gdonchyts/vegetation-monitor-tiles-z10'
+
+# tile image records are fetched and written page by page, peak memory does not depend on the record count
+tile_cache_page_size = 1000
 
-    date_end = datetime.today()
-    date_begin = date_end - timedelta(days=365)
+
+def _get_cloudfree_tile_images(tile_ids, date_begin, date_end, thresholds=None):
+    """
+    Yields pages of images per z10 tile with their quality score, mostly cloud-free images are selected
+    :param tile_ids: system:index of tiles
+    :param thresholds: quality score thresholds per tile key, images are selected using these instead of
+    ranking all images of the period (incremental updates)
+    :return: generator of lists of tile image records, with selected 1 or 0
+    """
+    aoi = ee.FeatureCollection('users/gdonchyts/vegetation-monitor-aoi').geometry()
+    tiles = ee.FeatureCollection(tile_cache_tiles).filter(ee.Filter.inList('system:index', tile_ids))
 
     def get_tile_images(tile):
         region = tile.geometry().intersection(aoi, 500)
-        images = get_satellite_images(region, date_begin, date_end, True)
+
+        # scores are kept for all images, see get_mostly_clean_images()
+        images = get_satellite_images(region, date_begin, date_end, False)
+        images = add_quality_score(images, region, 95, 1000)
+
+        if thresholds is None:
+            max_image_count = images.size().multiply(ee.Number(1).subtract(cloud_frequency_nl)).toInt()
+            threshold = ee.Algorithms.If(max_image_count.gt(0),
+                                         images.sort('quality_score').limit(max_image_count)
+                                         .aggregate_max('quality_score'), -1)
+        else:
+            key = ee.Number(tile.get('tx')).format('%d').cat('_').cat(ee.Number(tile.get('ty')).format('%d'))
+            threshold = ee.Dictionary(thresholds).get(key, -1)
+
+        selected = ee.Filter.lte('quality_score', threshold)
+        images = images.filter(selected).map(lambda i: i.set('selected', 1)) \
+            .merge(images.filter(selected.Not()).map(lambda i: i.set('selected', 0)))
 
         def set_tile_properties(i):
             tile_image = ee.Feature(None).copyProperties(tile)
             tile_image = tile_image.set('image_time', i.get('system:time_start'))
             tile_image = tile_image.set('image_id', ee.String('COPERNICUS/S2/').cat(i.id()))
+            tile_image = tile_image.set('quality_score', i.get('quality_score'))
+            tile_image = tile_image.set('selected', i.get('selected'))
 
             return tile_image
 
         return images.map(set_tile_properties)
 
-    tile_images = tiles.map(get_tile_images).flatten()
-    tile_images = ee.FeatureCollection(tile_images).getInfo()
+    tile_images = ee.FeatureCollection(tiles.map(get_tile_images).flatten())
+
+    def get_page(offset, count):
+        return tile_images.toList(count, offset).map(lambda f: ee.Feature(f).toDictionary()).getInfo()
+
+    return tile_cache.iter_pages(get_page, tile_cache_page_size)
+
+
+def _update_image_quality(db, tile_images, job):
+    """
+    Adds quality scores of images to s2-image-quality, one compact document per tile, see
+    tile_cache.encode_tile(). Documents are written under the id of the full job which computed the scores
+    (quality_job), incremental jobs add scores to the documents of the last full job. The index reads the
+    documents of the quality_job of the state, so that scores of a running full job are not mixed in.
+    Scores are merged with the stored scores of a tile, images of a tile can span pages.
+    """
+    if job.get('quality_job') is None:
+        # no full update with quality scores yet
+        return
+
+    quality_ref = db.collection(u's2-image-quality')
+
+    tiles = {}
+    for tile_image in tile_images:
+        tiles.setdefault(tile_cache.get_tile_key(tile_image['tx'], tile_image['ty']), []).append(tile_image)
+
+    with bulk_writer.BulkWriter(db, retry_exceptions=firestore_retry_exceptions) as writer:
+        for key, new_tile_images in tiles.items():
+            tile_ref = quality_ref.document('{0}_{1}'.format(job['quality_job'], key))
+
+            previous = tile_ref.get().to_dict()
+            previous = tile_cache.decode_tile(previous) if previous else []
+
+            tile = tile_cache.encode_tile(tile_cache.merge_tile_images(previous, new_tile_images, job['time_expire']))
+            tile['job'] = job['quality_job']
+
+            writer.set(tile_ref, tile)
+
+
+def _get_chunk_tile_images(db, keys, new_tile_images, job):
+    """
+    Returns all tile image records of the tiles of a chunk after the chunk is updated. These are the new
+    records for full jobs and the new records merged with the stored records for incremental jobs.
+    :param keys: tile keys of the chunk
+    :param new_tile_images: selected tile image records of the chunk
+    :return: {tile key: tile image records}
+    """
+    tiles = {key: [] for key in keys}
+    for tile_image in new_tile_images:
+        tiles.setdefault(tile_cache.get_tile_key(tile_image['tx'], tile_image['ty']), []).append(tile_image)
+
+    if job['mode'] == 'incremental':
+        tiles_ref = db.collection(u's2-tile-cache-tiles')
+
+        previous = {t.id: t.to_dict() for t in db.get_all([tiles_ref.document(key) for key in tiles])}
+
+        for key in tiles:
+            previous_tile_images = tile_cache.decode_tile(previous[key]) if previous.get(key) else []
+
+            tiles[key] = tile_cache.merge_tile_images(previous_tile_images, tiles[key], job['time_expire'])
+
+    return tiles
+
+
+def _is_tile_cache_job_abandoned(job):
+    started = datetime.utcfromtimestamp(job.get('started', int(job['id'])) / 1000.0)
+
+    return job.get('failures', 0) >= tile_cache_job_max_failures or \
+        datetime.utcnow() - started > tile_cache_job_max_age
+
+
+def _start_tile_cache_job(mode, state):
+    """
+    Returns a new job, dates, thresholds and chunks of tiles are fixed so that the job can be resumed
+    """
+    now = datetime.utcnow()
+    date_expire = now - timedelta(days=tile_cache_days)
+
+    job_id = str(_to_millis(now))
+
+    if mode == 'incremental' and state:
+        date_begin = max(datetime.utcfromtimestamp(state['time_end'] / 1000.0) - tile_cache_overlap, date_expire)
+        thresholds = state['thresholds']
+        quality_job = state.get('quality_job')
+    else:
+        mode = 'full'
+        date_begin = date_expire
+        thresholds = None
+        quality_job = job_id
+
+    tiles = ee.FeatureCollection(tile_cache_tiles) \
+        .reduceColumns(ee.Reducer.toList(3), ['system:index', 'tx', 'ty']).get('list').getInfo()
+
+    return {
+        'id': job_id,
+        'mode': mode,
+        'time_begin': _to_millis(date_begin),
+        'time_end': _to_millis(now),
+        'time_expire': _to_millis(date_expire),
+        'thresholds': thresholds,
+        'quality_job': quality_job,
+        'tiles': [{
+            'ids': [id for id, tx, ty in chunk],
+            'keys': [tile_cache.get_tile_key(tx, ty) for id, tx, ty in chunk]
+        } for chunk in zonal.iter_chunks(tiles, tile_cache_chunk_size)],
+        'chunks': {},
+        'started': _to_millis(now),
+        'failures': 0,
+        'error': None,
+        'finished': False
+    }
+
+
+@app.route('/update_cloudfree_tile_images/', methods=['GET'])
+@flask_cors.cross_origin()
+def update_cloudfree_tile_images():
+    """
+    Updates mostly cloud-free images per z10 tile in s2-tile-cache. By default only images acquired since
+    the last run are added and records older than a year are removed, mode=full recomputes the full year.
+
+    Tiles are computed in chunks, a job which does not finish within the time budget (or fails) is resumed
+    from the last completed chunk by the next call. A job failing repeatedly or running for too long is
+    abandoned, the next call starts a new job.
+    """
+    mode = request.args.get('mode', 'incremental')
 
-    tile_images = [f['properties'] for f in tile_images['features']]
+    if mode not in ['incremental', 'full']:
+        return 'Error: mode {0} is not supported, only incremental or full available'.format(mode)
 
     db = firestore.Client()
     tile_images_ref = db.collection(u's2-tile-cache')
+    compact_tiles_ref = db.collection(u's2-tile-cache-tiles')
+    state_ref = db.collection(u's2-tile-cache-state').document(u'state')
+    job_ref = db.collection(u's2-tile-cache-state').document(u'job')
+    stats_ref = db.collection(u's2-tile-cache-state').document(u'stats')
 
-    # delete previous tile_image records
-    for tile in tile_images_ref.stream():
-        tile.reference.delete()
+    job = job_ref.get().to_dict()
 
-    # add new tile_image records
-    for tile_image in tile_images:
-        t = tile_images_ref.document()
-        tile_image['txty'] = _compound_tile_index(tile_image['tx'], tile_image['ty'])
-        t.set(tile_image)
+    if job and not job['finished'] and _is_tile_cache_job_abandoned(job):
+        print('Abandoning tile cache job {0} after {1} failures, last error: {2}'
+              .format(job['id'], job.get('failures', 0), job.get('error')))
+        job = None
+
+    if not job or job['finished'] or (mode == 'full' and job['mode'] != 'full'):
+        job = _start_tile_cache_job(mode, state_ref.get().to_dict())
+        job_ref.set(job)
+
+    date_begin = datetime.utcfromtimestamp(job['time_begin'] / 1000.0)
+    date_end = datetime.utcfromtimestamp(job['time_end'] / 1000.0)
+
+    def update_chunk(index, chunk):
+        started = datetime.utcnow()
+
+        pages = _get_cloudfree_tile_images(chunk['ids'], date_begin, date_end, job['thresholds'])
+
+        count = 0
+        thresholds = {}
+        selected = []
+
+        with bulk_writer.BulkWriter(db, retry_exceptions=firestore_retry_exceptions) as writer:
+            for tile_images in pages:
+                # quality_score is missing if the image has no pixels in the tile
+                quality = [{k: t.get(k) for k in ['tx', 'ty', 'image_time', 'image_id', 'quality_score']}
+                           for t in tile_images]
+                _update_image_quality(db, quality, job)
+
+                tile_images = [t for t in tile_images if t.pop('selected')]
+
+                for tile_image in tile_images:
+                    tile_image['txty'] = tile_cache.compound_tile_index(tile_image['tx'], tile_image['ty'])
+                    tile_image['job'] = job['id']
+
+                    writer.set(tile_images_ref.document(tile_cache.get_tile_image_id(tile_image)), tile_image)
+
+                count += len(tile_images)
+                tile_cache.get_tile_thresholds(tile_images, thresholds)
+                selected.extend(tile_images)
+
+        tiles = _get_chunk_tile_images(db, chunk['keys'], selected, job)
+
+        # compact documents of the chunk tiles, see write_compact_tile_cache()
+        with bulk_writer.BulkWriter(db, retry_exceptions=firestore_retry_exceptions) as writer:
+            for key, tile_images in tiles.items():
+                if tile_images:
+                    writer.set(compact_tiles_ref.document(key), tile_cache.encode_tile(tile_images))
+                else:
+                    writer.delete(compact_tiles_ref.document(key))
+
+        # statistics of the chunk tiles, aggregated when the job finishes
+        stats = tile_cache.get_tile_cache_stats(t for tile_images in tiles.values() for t in tile_images)
+
+        job_ref.update({
+            u'chunks.chunk_{0}'.format(index): {
+                'count': count,
+                'seconds': (datetime.utcnow() - started).total_seconds(),
+                'thresholds': thresholds,
+                'stats': stats
+            }
+        })
+
+    completed = set(int(key.split('_')[-1]) for key in job['chunks'])
+
+    try:
+        done = tile_cache.run_chunks(update_chunk, job['tiles'], completed, tile_cache_max_workers,
+                                     tile_cache_time_budget)
+    except Exception as e:
+        # completed chunks are recorded in the job, cron retries and the next call resumes the job
+        traceback.print_exc()
+
+        failures = job.get('failures', 0) + 1
+        job_ref.update({'failures': failures, 'error': str(e)})
+
+        return 'FAILED: {0}, job failed {1} of {2} times'.format(e, failures, tile_cache_job_max_failures), 503
+
+    completed.update(done)
+
+    if len(completed) < len(job['tiles']):
+        return 'IN PROGRESS: {0} of {1} chunks completed'.format(len(completed), len(job['tiles'])), 503
+
+    job = job_ref.get().to_dict()
+
+    with bulk_writer.BulkWriter(db, retry_exceptions=firestore_retry_exceptions) as writer:
+        # delete previous tile_image records
+        if job['mode'] == 'full':
+            expired = [t.reference for t in tile_images_ref.select([u'job']).stream()
+                       if t.to_dict().get('job') != job['id']]
+        else:
+            # select no fields but the document name, an empty selection returns all fields
+            expired = tile_images_ref.where(u'image_time', u'<', job['time_expire']).select([u'__name__']).stream()
+            expired = [t.reference for t in expired]
+
+        for tile in expired:
+            writer.delete(tile)
+
+    state = state_ref.get().to_dict() or {}
+
+    thresholds = job['thresholds']
+    quality_time_begin = state.get('quality_time_begin')
+    quality_job = state.get('quality_job')
+    if job['mode'] == 'full':
+        thresholds = {}
+        for chunk in job['chunks'].values():
+            thresholds.update(chunk['thresholds'])
+
+        # quality scores of all images are stored since this full update
+        quality_time_begin = job['time_begin']
+        quality_job = job['quality_job']
+
+    state_ref.set({
+        'time_end': job['time_end'],
+        'thresholds': thresholds,
+        'quality_time_begin': quality_time_begin,
+        'quality_job': quality_job,
+        'mode': job['mode'],
+        'updated': _to_millis(datetime.utcnow())
+    })
+
+    # quality scores of previous full jobs, deleted once the state refers to the scores of this job
+    if job['mode'] == 'full':
+        with bulk_writer.BulkWriter(db, retry_exceptions=firestore_retry_exceptions) as writer:
+            for t in db.collection(u's2-image-quality').select([u'job']).stream():
+                if t.to_dict().get('job') != job['quality_job']:
+                    writer.delete(t.reference)
+
+    job_ref.update({'finished': True})
+
+    # statistics are aggregated from the chunks, compact documents are written per chunk
+    stats = tile_cache.merge_tile_cache_stats([chunk['stats'] for chunk in job['chunks'].values()])
+
+    # documents of tiles which are no longer updated
+    if job['mode'] == 'full':
+        keys = set(key for tiles in job['tiles'] for key in tiles['keys'])
+
+        with bulk_writer.BulkWriter(db, retry_exceptions=firestore_retry_exceptions) as writer:
+            for t in compact_tiles_ref.list_documents():
+                if t.id not in keys:
+                    writer.delete(t)
+
+    stats['updated'] = _to_millis(datetime.utcnow())
+    stats_ref.set(stats)
+
+    _load_tile_times_index()
+
+    _load_image_quality_index()
 
     return 'DONE'
 
@@ -1503,9 +2952,65 @@ def update_cloudfree_tile_images():
 @flask_cors.cross_origin()
 def get_cloudfree_tile_image_count():
     db = firestore.Client()
-    tile_images = db.collection(u's2-tile-cache').list_documents()
+    stats = db.collection(u's2-tile-cache-state').document(u'stats').get().to_dict()
+
+    # stats are written by update_cloudfree_tile_images, count documents if it did not run yet
+    if stats is None:
+        return str(len(list(db.collection(u's2-tile-cache').list_documents())))
+
+    return str(stats['count'])
+
+
+@app.route('/get_cloudfree_tile_image_stats/', methods=['GET'])
+@flask_cors.cross_origin()
+def get_cloudfree_tile_image_stats():
+    """
+    Returns number of cached tile images in total and per tile, time range, last update time and the state
+    of the last update job
+    """
+    db = firestore.Client()
+    stats = db.collection(u's2-tile-cache-state').document(u'stats').get().to_dict()
+
+    if stats is None:
+        return 'Error: tile image statistics are not available, update_cloudfree_tile_images did not run yet'
+
+    for key, date_key in [('time_min', 'date_min'), ('time_max', 'date_max'), ('updated', 'date_updated')]:
+        if stats[key] is not None:
+            stats[date_key] = _format_time(stats[key])
+
+    # progress and failures of the last job, a failing job leaves the statistics unchanged
+    job = db.collection(u's2-tile-cache-state').document(u'job').get().to_dict()
+
+    if job:
+        stats['job'] = {
+            'id': job['id'],
+            'mode': job['mode'],
+            'finished': job['finished'],
+            'chunks': '{0} of {1}'.format(len(job['chunks']), len(job['tiles'])),
+            'failures': job.get('failures', 0),
+            'error': job.get('error')
+        }
+
+    return jsonify(stats)
+
+
+@app.route('/cache/stats/', methods=['GET'])
+@flask_cors.cross_origin()
+def get_cache_stats():
+    """
+    Returns size and hit/miss counters of in-process caches
+    """
+
+    stats = {
+        'map_url': map_url_cache.stats(),
+        'landuse_classifier': landuse_classifier_cache.stats(),
+        'zonal_feature': zonal_feature_cache.stats(),
+        'catalog': image_catalog.stats(),
+        'tile_times_index': tile_times_index_cache.stats(),
+        'image_quality_index': image_quality_index_cache.stats()
+    }
 
-    return str(len(list(tile_images)))
+    return jsonify(stats)
 
 
 @app.route('/')
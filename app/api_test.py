@@ -248,6 +248,52 @@ def test_get_zonal_info_landuse_yearly(client):
     assert output[0]["area_per_type"] == output_expected[0]["area_per_type"]
 
 
+def test_get_zonal_info_layers(client):
+    input = '''{
+        "region": {
+            "type": "FeatureCollection",
+            "features": [
+                {
+                    "type": "Feature",
+                    "geometry": {
+                        "type": "Polygon",
+                        "coordinates": [[
+                            [5.846,51.984],
+                            [5.849,51.961],
+                            [5.910,51.960],
+                            [5.916,51.985],
+                            [5.877,51.990],
+                            [5.846,51.984]
+                        ]]
+                    },
+                    "properties": {
+                        "id": 1
+                    }
+                }
+            ]
+        },
+        "layers": ["landuse", "legger"],
+        "dateBegin": "2016-07-20",
+        "dateEnd": "2016-07-21",
+        "assetType": "day",
+        "scale": 100
+        }'''
+
+    r = client.post('/map/zonal-info/', data=input,
+                    content_type='application/json')
+
+    assert r.status_code == 200
+
+    s = r.get_data(as_text=True)
+    write_test_output('test_output_zonal_layers.json', s)
+
+    output = json.loads(s)
+
+    assert output[0]["id"] == 1
+    assert sorted(output[0]["area_per_type"].keys()) == ["landuse", "legger"]
+    assert len(output[0]["area_per_type"]["legger"]) == 6
+
+
 def test_get_map_landuse(client):
     input = '''{
                    "dateBegin": "2016-07-20",
@@ -673,3 +719,20 @@ def test_get_2020_legger_image_by_date():
     id = legger.get('system:id').getInfo()
     # Legger ID returned after 2020-05-24 should be 2020 legger
     assert id == 'projects/deltares-rws/vegetatiemonitor/legger-2020-6-class-10m'
+
+
+def test_get_zonal_info_layers_invalid(client):
+    for layers in ['[]', '"landuse"', '["landuse", "ndvi"]', '["landuse", "landuse"]']:
+        input = '''{
+            "region": {"type": "FeatureCollection", "features": []},
+            "layers": %s,
+            "dateBegin": "2016-07-20",
+            "assetType": "day",
+            "scale": 100
+            }''' % layers
+
+        r = client.post('/map/zonal-info/', data=input,
+                        content_type='application/json')
+
+        assert r.status_code == 200
+        assert r.get_data(as_text=True).startswith('Error:')
@@ -0,0 +1,114 @@
+'''Batched Firestore writes, committed concurrently.'''
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+class BulkWriter(object):
+    """
+    Groups set and delete operations into Firestore batches and commits batches concurrently. Batches
+    failing with one of retry_exceptions (e.g. contention) are retried with exponential backoff.
+
+    with BulkWriter(db) as writer:
+        writer.set(db.collection('c').document('id'), {...})
+    """
+
+    def __init__(self, client, batch_size=500, max_workers=4, retry_exceptions=(), max_retries=5,
+                 retry_delay=0.5):
+        """
+        :param client: Firestore client
+        :param batch_size: operations per batch, at most 500 for Firestore
+        :param max_workers: maximum number of concurrent commits
+        :param retry_exceptions: tuple of exception types for which a commit is retried
+        :param max_retries: maximum number of retries per batch
+        :param retry_delay: seconds before the first retry, doubled for every next retry
+        """
+        self.client = client
+        self.batch_size = batch_size
+        self.max_workers = max_workers
+        self.retry_exceptions = retry_exceptions
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+
+        self.writes = 0
+        self.batches = 0
+        self.retries = 0
+
+        self._operations = []
+        self._futures = []
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self._executor.shutdown(wait=True)
+
+    def set(self, reference, data):
+        self._add(('set', reference, data))
+
+    def delete(self, reference):
+        self._add(('delete', reference, None))
+
+    def _add(self, operation):
+        self._operations.append(operation)
+
+        if len(self._operations) >= self.batch_size:
+            self._submit()
+
+    def _submit(self):
+        operations, self._operations = self._operations, []
+
+        # bound the number of pending batches, operations are kept in memory until committed
+        while len(self._futures) >= 2 * self.max_workers:
+            self._futures.pop(0).result()
+
+        self._futures.append(self._executor.submit(self._commit, operations))
+
+    def _commit(self, operations):
+        for attempt in range(self.max_retries + 1):
+            batch = self.client.batch()
+
+            for op, reference, data in operations:
+                if op == 'set':
+                    batch.set(reference, data)
+                else:
+                    batch.delete(reference)
+
+            try:
+                batch.commit()
+                break
+            except self.retry_exceptions:
+                if attempt == self.max_retries:
+                    raise
+
+                with self._lock:
+                    self.retries += 1
+
+                time.sleep(self.retry_delay * 2 ** attempt)
+
+        with self._lock:
+            self.writes += len(operations)
+            self.batches += 1
+
+    def flush(self):
+        """
+        Commits all pending operations, raises the first commit error
+        """
+        if self._operations:
+            self._submit()
+
+        futures, self._futures = self._futures, []
+
+        for future in futures:
+            future.result()
+
+    def close(self):
+        try:
+            self.flush()
+        finally:
+            self._executor.shutdown(wait=True)
@@ -0,0 +1,80 @@
+import threading
+
+import pytest
+
+from . import bulk_writer
+
+
+class Contention(Exception):
+    pass
+
+
+class FakeBatch(object):
+    def __init__(self, client):
+        self.client = client
+        self.operations = []
+
+    def set(self, reference, data):
+        self.operations.append((reference, data))
+
+    def delete(self, reference):
+        self.operations.append((reference, None))
+
+    def commit(self):
+        with self.client.lock:
+            self.client.commits += 1
+
+            if self.client.commits in self.client.fail_commits:
+                raise self.client.error
+
+            for reference, data in self.operations:
+                if data is None:
+                    self.client.documents.pop(reference, None)
+                else:
+                    self.client.documents[reference] = data
+
+
+class FakeClient(object):
+    def __init__(self, fail_commits=(), error=Contention):
+        self.documents = {}
+        self.commits = 0
+        self.fail_commits = fail_commits
+        self.error = error
+        self.lock = threading.Lock()
+
+    def batch(self):
+        return FakeBatch(self)
+
+
+def test_bulk_writer_batches_operations():
+    client = FakeClient()
+    client.documents = {'old': {'a': 0}}
+
+    with bulk_writer.BulkWriter(client, batch_size=10, max_workers=2) as writer:
+        for i in range(25):
+            writer.set(str(i), {'a': i})
+        writer.delete('old')
+
+    assert len(client.documents) == 25
+    assert client.documents['24'] == {'a': 24}
+    assert (writer.writes, writer.batches) == (26, 3)
+
+
+def test_bulk_writer_retries_contention():
+    client = FakeClient(fail_commits=(1, 2))
+
+    with bulk_writer.BulkWriter(client, retry_exceptions=(Contention,), retry_delay=0) as writer:
+        writer.set('a', {'a': 1})
+
+    assert client.documents == {'a': {'a': 1}}
+    assert writer.retries == 2
+
+
+def test_bulk_writer_raises_other_errors():
+    client = FakeClient(fail_commits=(1,), error=ValueError)
+
+    writer = bulk_writer.BulkWriter(client, retry_exceptions=(Contention,), retry_delay=0)
+    writer.set('a', {'a': 1})
+
+    with pytest.raises(ValueError):
+        writer.close()
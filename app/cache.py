@@ -0,0 +1,110 @@
+'''In-process caches for results of Google Earth Engine requests.'''
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+
+
+def make_key(*parts):
+    """
+    Returns a canonical hash for the given request parameters. Dictionaries are
+    serialized with sorted keys, so the order of keys in a request body does not matter.
+    :param parts: JSON-serializable values
+    :return: hex digest
+    """
+    s = json.dumps(parts, sort_keys=True, separators=(',', ':'), default=str)
+
+    return hashlib.sha1(s.encode('utf-8')).hexdigest()
+
+
+class TTLCache(object):
+    """
+    Thread-safe LRU cache with an optional time-to-live per entry.
+    """
+
+    def __init__(self, maxsize=1024, ttl=None):
+        """
+        :param maxsize: maximum number of entries, least recently used entries are evicted first
+        :param ttl: time-to-live of entries in seconds, None means entries do not expire
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+
+            if entry is not None:
+                value, expires = entry
+
+                if expires is None or expires > time.time():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+
+                del self._entries[key]
+
+            self.misses += 1
+            return default
+
+    def get_stale(self, key, default=None):
+        """
+        Returns a value and whether it is fresh. Expired values are returned as well and kept, e.g. to
+        serve them while a new value is loaded.
+        :return: (value, fresh)
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+
+            if entry is None:
+                self.misses += 1
+                return default, False
+
+            value, expires = entry
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+
+            return value, expires is None or expires > time.time()
+
+    def set(self, key, value, ttl=None):
+        """
+        :param key:
+        :param value:
+        :param ttl: time-to-live of this entry in seconds, defaults to ttl of the cache
+        """
+        if ttl is None:
+            ttl = self.ttl
+
+        expires = None
+        if ttl is not None:
+            expires = time.time() + ttl
+
+        with self._lock:
+            self._entries[key] = (value, expires)
+            self._entries.move_to_end(key)
+
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        return {
+            'size': len(self._entries),
+            'maxsize': self.maxsize,
+            'ttl': self.ttl,
+            'hits': self.hits,
+            'misses': self.misses
+        }
@@ -0,0 +1,55 @@
+import time
+
+from . import cache
+
+
+def test_make_key_ignores_key_order():
+    vis1 = {'min': 0.05, 'max': [0.35, 0.35, 0.45], 'bands': ['swir', 'nir', 'green']}
+    vis2 = {'bands': ['swir', 'nir', 'green'], 'max': [0.35, 0.35, 0.45], 'min': 0.05}
+
+    assert cache.make_key('satellite', '2016-07-20', None, vis1) == \
+        cache.make_key('satellite', '2016-07-20', None, vis2)
+
+    assert cache.make_key('satellite', '2016-07-20', None, vis1) != \
+        cache.make_key('ndvi', '2016-07-20', None, vis1)
+
+
+def test_ttl_cache_evicts_least_recently_used():
+    c = cache.TTLCache(maxsize=2)
+
+    c.set('a', 1)
+    c.set('b', 2)
+    c.get('a')
+    c.set('c', 3)
+
+    assert c.get('a') == 1
+    assert c.get('b') is None
+    assert c.get('c') == 3
+    assert c.stats()['hits'] == 3
+    assert c.stats()['misses'] == 1
+
+
+def test_ttl_cache_expires_entries():
+    c = cache.TTLCache(maxsize=2, ttl=0.05)
+
+    c.set('a', 1)
+    assert c.get('a') == 1
+
+    time.sleep(0.1)
+
+    assert c.get('a') is None
+    assert len(c) == 0
+
+
+def test_ttl_cache_get_stale_keeps_expired_entries():
+    c = cache.TTLCache(maxsize=2, ttl=0.05)
+
+    assert c.get_stale('a') == (None, False)
+
+    c.set('a', 1)
+    assert c.get_stale('a') == (1, True)
+
+    time.sleep(0.1)
+
+    assert c.get_stale('a') == (1, False)
+    assert len(c) == 1
@@ -0,0 +1,111 @@
+'''Cached catalog of images in (yearly) image collections, answers time and region queries locally.'''
+import threading
+import time
+
+import geometry
+import singleflight
+
+
+class Catalog(object):
+    """
+    Keeps a list of images (id, time, bounds) per collection. Collections are revalidated cheaply
+    by comparing their update time, and fetched again when changed or when max_age is exceeded.
+    """
+
+    def __init__(self, fetch_images, fetch_update_time, revalidate_interval=10 * 60, max_age=24 * 60 * 60,
+                 footprint_margin=0):
+        """
+        :param fetch_images: function(collection), returns [{'id': ..., 'time': ..., 'bounds': ...}, ...], other
+        fields of images are kept
+        :param fetch_update_time: function(collection), returns update time of the collection
+        :param revalidate_interval: seconds between update time checks
+        :param max_age: seconds after which images are fetched again
+        :param footprint_margin: margin added to bounds tested against footprints, at least the error of
+        simplified footprints
+        """
+        self.fetch_images = fetch_images
+        self.fetch_update_time = fetch_update_time
+        self.revalidate_interval = revalidate_interval
+        self.max_age = max_age
+        self.footprint_margin = footprint_margin
+
+        self._entries = {}
+        self._lock = threading.Lock()
+        self._in_flight = singleflight.SingleFlight()
+        self._fetches = 0
+        self._checks = 0
+
+    def get(self, collection):
+        """
+        Returns images of a collection, sorted by time
+        """
+        with self._lock:
+            entry = self._entries.get(collection)
+
+            if entry is not None and self._is_fresh(entry, time.time()):
+                return entry['images']
+
+        # EE is called without holding the lock, concurrent callers of the same collection share one call
+        return self._in_flight.do(collection, self._refresh, collection)
+
+    def _is_fresh(self, entry, now):
+        return now - entry['fetched'] < self.max_age and now - entry['checked'] < self.revalidate_interval
+
+    def _refresh(self, collection):
+        now = time.time()
+
+        with self._lock:
+            entry = self._entries.get(collection)
+
+        if entry is not None and self._is_fresh(entry, now):
+            return entry['images']
+
+        update_time = self.fetch_update_time(collection)
+
+        if entry is not None and now - entry['fetched'] < self.max_age:
+            with self._lock:
+                self._checks += 1
+
+                if update_time == entry['update_time']:
+                    self._entries[collection] = dict(entry, checked=now)
+                    return entry['images']
+
+        images = sorted(self.fetch_images(collection), key=lambda i: i['time'])
+
+        with self._lock:
+            self._fetches += 1
+
+            self._entries[collection] = {
+                'images': images,
+                'update_time': update_time,
+                'fetched': now,
+                'checked': now
+            }
+
+        return images
+
+    def stats(self):
+        with self._lock:
+            return {
+                'collections': len(self._entries),
+                'images': sum(len(e['images']) for e in self._entries.values()),
+                'fetches': self._fetches,
+                'checks': self._checks
+            }
+
+    def find(self, collection, bounds, time_begin, time_end):
+        """
+        Returns images of a collection intersecting bounds, within a time range. Images with a footprint
+        (exterior ring) should intersect bounds with their footprint, not only with their bounds.
+        :param collection:
+        :param bounds: [xmin, ymin, xmax, ymax]
+        :param time_begin: milliseconds
+        :param time_end: milliseconds, exclusive
+        :return: list of images, sorted by time
+        """
+        margin = self.footprint_margin
+        footprint_bounds = [bounds[0] - margin, bounds[1] - margin, bounds[2] + margin, bounds[3] + margin]
+
+        return [i for i in self.get(collection)
+                if time_begin <= i['time'] < time_end and geometry.intersects(bounds, i['bounds']) and
+                (i.get('footprint') is None or geometry.ring_intersects(i['footprint'], footprint_bounds))]
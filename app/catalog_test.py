@@ -0,0 +1,118 @@
+import os
+import sys
+import threading
+
+# catalog imports sibling modules the same way api.py does
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from . import catalog  # noqa: E402
+
+
+class FakeCollections(object):
+    def __init__(self):
+        self.update_time = '2019-03-01T00:00:00Z'
+        self.images = [
+            {'id': 'yearly/2018', 'time': 1527811200000, 'bounds': [5.0, 51.0, 6.5, 52.5]},
+            {'id': 'yearly/2017', 'time': 1496275200000, 'bounds': [5.0, 51.0, 6.5, 52.5]},
+            {'id': 'yearly/2017-maas', 'time': 1496275200000, 'bounds': [5.5, 50.7, 6.0, 51.5]}
+        ]
+        self.fetches = 0
+        self.checks = 0
+
+    def fetch_images(self, collection):
+        self.fetches += 1
+        return list(self.images)
+
+    def fetch_update_time(self, collection):
+        self.checks += 1
+        return self.update_time
+
+
+def test_catalog_find():
+    collections = FakeCollections()
+    c = catalog.Catalog(collections.fetch_images, collections.fetch_update_time)
+
+    images = c.find('yearly', [5.8, 51.9, 5.9, 52.0], 0, 2000000000000)
+    assert [i['id'] for i in images] == ['yearly/2017', 'yearly/2018']
+
+    images = c.find('yearly', [5.6, 50.8, 5.7, 50.9], 0, 2000000000000)
+    assert [i['id'] for i in images] == ['yearly/2017-maas']
+
+    images = c.find('yearly', [5.8, 51.9, 5.9, 52.0], 1500000000000, 2000000000000)
+    assert [i['id'] for i in images] == ['yearly/2018']
+
+    assert collections.fetches == 1
+
+
+def test_catalog_find_footprints():
+    collections = FakeCollections()
+
+    # the Maas image covers the south-east half of its bounds, bounds of both images overlap
+    collections.images = [
+        {'id': 'yearly/2017-rijn', 'time': 1496275200000, 'bounds': [5.0, 51.8, 6.5, 52.5],
+         'footprint': [[5.0, 51.8], [6.5, 51.8], [6.5, 52.5], [5.0, 52.5], [5.0, 51.8]]},
+        {'id': 'yearly/2017-maas', 'time': 1496275200000, 'bounds': [5.0, 50.7, 6.0, 52.0],
+         'footprint': [[5.0, 50.7], [6.0, 50.7], [6.0, 52.0], [5.0, 50.7]]}
+    ]
+
+    c = catalog.Catalog(collections.fetch_images, collections.fetch_update_time)
+
+    # region in the north-west of the Maas bounds, outside of its footprint
+    images = c.find('yearly', [5.1, 51.85, 5.2, 51.95], 0, 2000000000000)
+    assert [i['id'] for i in images] == ['yearly/2017-rijn']
+
+    images = c.find('yearly', [5.8, 51.85, 5.9, 51.95], 0, 2000000000000)
+    assert [i['id'] for i in images] == ['yearly/2017-rijn', 'yearly/2017-maas']
+
+
+def test_catalog_revalidates_update_time():
+    collections = FakeCollections()
+    c = catalog.Catalog(collections.fetch_images, collections.fetch_update_time, revalidate_interval=0)
+
+    c.get('yearly')
+    c.get('yearly')
+
+    assert collections.fetches == 1
+    assert collections.checks == 2
+
+    collections.update_time = '2020-03-01T00:00:00Z'
+    collections.images.append({'id': 'yearly/2019', 'time': 1559347200000, 'bounds': [5.0, 51.0, 6.5, 52.5]})
+
+    images = c.get('yearly')
+
+    assert collections.fetches == 2
+    assert images[-1]['id'] == 'yearly/2019'
+
+    assert c.stats() == {'collections': 1, 'images': 4, 'fetches': 2, 'checks': 2}
+
+
+def test_catalog_fetches_without_blocking_other_collections():
+    collections = FakeCollections()
+    fetching = threading.Event()
+    release = threading.Event()
+
+    def fetch_images(collection):
+        if collection == 'slow':
+            fetching.set()
+            release.wait(5)
+
+        return collections.fetch_images(collection)
+
+    c = catalog.Catalog(fetch_images, collections.fetch_update_time)
+    c.get('yearly')
+
+    threads = [threading.Thread(target=c.get, args=('slow',)) for _ in range(3)]
+    for t in threads:
+        t.start()
+
+    fetching.wait(5)
+
+    # a cached collection is returned while another one is fetched
+    assert len(c.get('yearly')) == 3
+
+    release.set()
+    for t in threads:
+        t.join()
+
+    # concurrent callers of a collection share one fetch
+    assert collections.fetches == 2
@@ -0,0 +1,22 @@
+# python cmd_compact_tile_cache.py
+# afterwards, set TILE_CACHE_LAYOUT=tiles to read s2-tile-cache-tiles instead of s2-tile-cache
+
+from google.cloud import firestore
+
+import main  # initializes Earth Engine and Firestore credentials
+import api
+
+
+def compact_tile_cache():
+    db = firestore.Client()
+
+    tile_images = api.read_tile_image_records(db)
+    tile_count = api.write_compact_tile_cache(db, tile_images)
+
+    return len(tile_images), tile_count
+
+
+if __name__ == '__main__':
+    record_count, tile_count = compact_tile_cache()
+
+    print('{0} tile image records written as {1} tile documents'.format(record_count, tile_count))
@@ -0,0 +1,41 @@
+# python cmd_training_points.py --points-per-class 500
+# python cmd_training_points.py --tiles users/gdonchyts/vegetation-monitor-tiles-z10 --asset-id <asset id> --seed 0
+
+import argparse
+
+import ee
+
+import main  # initializes Earth Engine
+import api
+
+
+def export_training_points(tiles_asset_id, asset_id, points_per_class, seed):
+    tiles = ee.FeatureCollection(tiles_asset_id)
+
+    points = api.get_landuse_training_points(tiles, points_per_class, seed)
+
+    task = ee.batch.Export.table.toAsset(**{
+        'collection': points,
+        'description': 'landuse-training-points',
+        'assetId': asset_id
+    })
+
+    task.start()
+
+    return task
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--tiles', dest='tiles', default=api.landuse_training_tiles,
+                        help='tiles asset id, points are sampled per tile')
+    parser.add_argument('--asset-id', dest='asset_id', default=api.landuse_training_points,
+                        help='output table asset id')
+    parser.add_argument('--points-per-class', dest='points_per_class', type=int, default=500,
+                        help='number of points per class per tile')
+    parser.add_argument('--seed', dest='seed', type=int, default=0, help='random seed')
+    args = parser.parse_args()
+
+    task = export_training_points(args.tiles, args.asset_id, args.points_per_class, args.seed)
+
+    print(task.status())
@@ -0,0 +1,152 @@
+'''Client-side helpers for GeoJSON geometries, used to avoid EE round trips.'''
+import math
+
+
+def _iter_coordinates(coordinates):
+    if coordinates and isinstance(coordinates[0], (int, float)):
+        yield coordinates
+    else:
+        for c in coordinates:
+            for xy in _iter_coordinates(c):
+                yield xy
+
+
+def get_bounds(geojson):
+    """
+    Returns bounds of a GeoJSON geometry, feature or feature collection
+    :param geojson: GeoJSON dictionary
+    :return: [xmin, ymin, xmax, ymax]
+    """
+    if geojson['type'] == 'FeatureCollection':
+        bounds = [get_bounds(f) for f in geojson['features']]
+    elif geojson['type'] == 'Feature':
+        return get_bounds(geojson['geometry'])
+    elif geojson['type'] == 'GeometryCollection':
+        bounds = [get_bounds(g) for g in geojson['geometries']]
+    else:
+        xs, ys = zip(*[xy[:2] for xy in _iter_coordinates(geojson['coordinates'])])
+
+        return [min(xs), min(ys), max(xs), max(ys)]
+
+    xmin, ymin, xmax, ymax = zip(*bounds)
+
+    return [min(xmin), min(ymin), max(xmax), max(ymax)]
+
+
+def snap_bounds(bounds, grid):
+    """
+    Expands bounds outwards to the nearest multiples of grid
+    :param bounds: [xmin, ymin, xmax, ymax]
+    :param grid: grid cell size
+    :return: [xmin, ymin, xmax, ymax]
+    """
+    xmin, ymin, xmax, ymax = bounds
+
+    return [
+        round(math.floor(xmin / grid) * grid, 10),
+        round(math.floor(ymin / grid) * grid, 10),
+        round(math.ceil(xmax / grid) * grid, 10),
+        round(math.ceil(ymax / grid) * grid, 10)
+    ]
+
+
+def _web_mercator_to_lon_lat(x, y):
+    r = 6378137.0
+
+    lon = math.degrees(x / r)
+    lat = math.degrees(2 * math.atan(math.exp(y / r)) - math.pi / 2)
+
+    return lon, lat
+
+
+def get_lon_lat_bounds(geojson):
+    """
+    Returns bounds in longitude and latitude of a GeoJSON geometry, in EPSG:4326 or EPSG:3857
+    :param geojson: GeoJSON dictionary, optionally with a named crs
+    :return: [xmin, ymin, xmax, ymax], or None if the crs is not supported
+    """
+    crs = (geojson.get('crs') or {}).get('properties', {}).get('name', 'EPSG:4326')
+
+    bounds = get_bounds(geojson)
+
+    if crs in ['EPSG:4326', 'urn:ogc:def:crs:OGC:1.3:CRS84']:
+        return bounds
+
+    if crs in ['EPSG:3857', 'EPSG:900913']:
+        xmin, ymin = _web_mercator_to_lon_lat(bounds[0], bounds[1])
+        xmax, ymax = _web_mercator_to_lon_lat(bounds[2], bounds[3])
+
+        return [xmin, ymin, xmax, ymax]
+
+    return None
+
+
+def intersects(bounds1, bounds2):
+    return bounds1[0] <= bounds2[2] and bounds2[0] <= bounds1[2] and \
+        bounds1[1] <= bounds2[3] and bounds2[1] <= bounds1[3]
+
+
+def _contains_point(ring, x, y):
+    inside = False
+
+    for (x1, y1), (x2, y2) in zip(ring, ring[1:] + ring[:1]):
+        if (y1 > y) != (y2 > y) and x < x1 + (y - y1) * (x2 - x1) / (y2 - y1):
+            inside = not inside
+
+    return inside
+
+
+def _segments_intersect(a, b, c, d):
+    def orientation(p, q, r):
+        v = (q[0] - p[0]) * (r[1] - p[1]) - (q[1] - p[1]) * (r[0] - p[0])
+        return (v > 0) - (v < 0)
+
+    return orientation(a, b, c) * orientation(a, b, d) <= 0 and orientation(c, d, a) * orientation(c, d, b) <= 0
+
+
+def ring_intersects(ring, bounds):
+    """
+    Tests if a polygon intersects bounds
+    :param ring: exterior ring of the polygon, [[x, y], ...]
+    :param bounds: [xmin, ymin, xmax, ymax]
+    :return: True if the polygon and bounds overlap or touch
+    """
+    xs, ys = zip(*ring)
+
+    if not intersects([min(xs), min(ys), max(xs), max(ys)], bounds):
+        return False
+
+    xmin, ymin, xmax, ymax = bounds
+
+    # a vertex of the polygon within bounds
+    if any(xmin <= x <= xmax and ymin <= y <= ymax for x, y in ring):
+        return True
+
+    # bounds within the polygon
+    if _contains_point(ring, xmin, ymin):
+        return True
+
+    # crossing edges
+    corners = [(xmin, ymin), (xmax, ymin), (xmax, ymax), (xmin, ymax)]
+    edges = list(zip(corners, corners[1:] + corners[:1]))
+
+    return any(_segments_intersect(p, q, c, d) for p, q in zip(ring, ring[1:] + ring[:1]) for c, d in edges)
+
+
+def ring_contains(ring, bounds):
+    """
+    Tests if a polygon contains bounds
+    :param ring: exterior ring of the polygon, [[x, y], ...]
+    :param bounds: [xmin, ymin, xmax, ymax]
+    :return: True if bounds are within the polygon, not touching its boundary
+    """
+    xmin, ymin, xmax, ymax = bounds
+    corners = [(xmin, ymin), (xmax, ymin), (xmax, ymax), (xmin, ymax)]
+
+    if not all(_contains_point(ring, x, y) for x, y in corners):
+        return False
+
+    # corners of bounds are within the polygon, the boundary of the polygon should not enter bounds
+    edges = list(zip(corners, corners[1:] + corners[:1]))
+
+    return not any(_segments_intersect(p, q, c, d) for p, q in zip(ring, ring[1:] + ring[:1]) for c, d in edges)
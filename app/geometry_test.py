@@ -0,0 +1,80 @@
+from . import geometry
+
+
+def test_get_bounds_feature_collection():
+    region = {
+        "type": "FeatureCollection",
+        "features": [
+            {
+                "type": "Feature",
+                "geometry": {
+                    "type": "Polygon",
+                    "coordinates": [[
+                        [5.846, 51.984], [5.849, 51.961], [5.910, 51.960],
+                        [5.916, 51.985], [5.877, 51.990], [5.846, 51.984]
+                    ]]
+                },
+                "properties": {"id": 1}
+            },
+            {
+                "type": "Feature",
+                "geometry": {"type": "Point", "coordinates": [5.95, 51.95]},
+                "properties": {"id": 2}
+            }
+        ]
+    }
+
+    assert geometry.get_bounds(region) == [5.846, 51.95, 5.95, 51.99]
+
+
+def test_snap_bounds():
+    bounds = geometry.snap_bounds([5.846, 51.961, 5.916, 51.990], 0.05)
+
+    assert bounds == [5.8, 51.95, 5.95, 52.0]
+
+
+def test_get_lon_lat_bounds_web_mercator():
+    region = {
+        "type": "Polygon",
+        "crs": {"type": "name", "properties": {"name": "EPSG:3857"}},
+        "coordinates": [[
+            [508764.86048223823, 6770486.217669737],
+            [528332.7397234514, 6770486.217669737],
+            [528332.7397234514, 6790054.09691095],
+            [508764.86048223823, 6790054.09691095],
+            [508764.86048223823, 6770486.217669737]
+        ]]
+    }
+
+    xmin, ymin, xmax, ymax = geometry.get_lon_lat_bounds(region)
+
+    assert round(xmin, 3) == 4.570
+    assert round(xmax, 3) == 4.746
+    assert 51.8 < ymin < ymax < 52.0
+
+
+def test_intersects():
+    assert geometry.intersects([0, 0, 2, 2], [1, 1, 3, 3])
+    assert not geometry.intersects([0, 0, 1, 1], [2, 2, 3, 3])
+
+
+def test_ring_intersects():
+    # partial swath, triangle in the lower right half of [0, 0, 2, 2]
+    ring = [[0, 0], [2, 0], [2, 2], [0, 0]]
+
+    assert geometry.ring_intersects(ring, [1.5, 0.2, 1.8, 0.5])
+    assert geometry.ring_intersects(ring, [-1, -1, 3, 3])
+    assert geometry.ring_intersects(ring, [0.9, 0.5, 1.1, 1.5])
+    assert not geometry.ring_intersects(ring, [0.2, 1.5, 0.5, 1.8])
+    assert not geometry.ring_intersects(ring, [3, 0, 4, 1])
+
+
+def test_ring_contains():
+    # L-shaped polygon, [1, 1, 2, 2] is cut out
+    ring = [[0, 0], [2, 0], [2, 1], [1, 1], [1, 2], [0, 2], [0, 0]]
+
+    assert geometry.ring_contains(ring, [0.2, 0.2, 0.8, 1.8])
+    assert geometry.ring_contains(ring, [0.2, 0.2, 1.8, 0.8])
+    assert not geometry.ring_contains(ring, [0.2, 0.2, 1.8, 1.8])
+    assert not geometry.ring_contains(ring, [1.2, 1.2, 1.8, 1.8])
+    assert not geometry.ring_contains(ring, [-1, 0.2, 0.5, 0.5])
@@ -0,0 +1,7 @@
+'''Gunicorn server hooks, see the entrypoint in app.yaml.'''
+
+
+def post_worker_init(worker):
+    import main
+
+    main.load_tile_times_index_in_background()
@@ -1,5 +1,6 @@
 import sys, os
 import base64
+import threading
 
 sys.path.append(os.getcwd())
 
@@ -46,9 +47,20 @@ os.environ['GOOGLE_APPLICATION_CREDENTIALS'] = FIREBASE_PRIVATE_KEY_FILE
 
 
 # from . import api  # initialize EE first
-from api import app
+from api import app, get_tile_times_index
+
+
+def load_tile_times_index_in_background():
+    """
+    Loads the tile cache index in the background, requests wait for the same load if it is still running.
+    Called by the server only (see gunicorn_config.py), not by scripts importing this module.
+    """
+    threading.Thread(target=get_tile_times_index, daemon=True).start()
+
 
 if __name__ == '__main__':
+    load_tile_times_index_in_background()
+
     # This is used when running locally. Gunicorn is used to run the
     # application on Google App Engine. See entrypoint in app.yaml.
     app.run(host='127.0.0.1', port=8081, debug=True, ssl_context='adhoc')
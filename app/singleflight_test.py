@@ -0,0 +1,101 @@
+import threading
+import time
+
+import pytest
+
+from . import singleflight
+
+
+class SlowBackend(object):
+    """
+    Fake EE backend, counts upstream calls and takes some time to respond.
+    """
+
+    def __init__(self, delay=0.2, error=None):
+        self.delay = delay
+        self.error = error
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def get_map_id(self, layer):
+        with self._lock:
+            self.calls += 1
+
+        time.sleep(self.delay)
+
+        if self.error:
+            raise self.error
+
+        return 'mapid-' + layer
+
+
+def run_concurrently(n, fn):
+    results = [None] * n
+    errors = [None] * n
+    barrier = threading.Barrier(n)
+
+    def worker(i):
+        barrier.wait()
+        try:
+            results[i] = fn()
+        except Exception as e:
+            errors[i] = e
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(n)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    return results, errors
+
+
+def test_concurrent_calls_share_one_upstream_call():
+    backend = SlowBackend()
+    flight = singleflight.SingleFlight()
+
+    results, errors = run_concurrently(32, lambda: flight.do('landuse', backend.get_map_id, 'landuse'))
+
+    assert backend.calls == 1
+    assert results == ['mapid-landuse'] * 32
+    assert errors == [None] * 32
+
+
+def test_concurrent_calls_share_error():
+    backend = SlowBackend(error=ValueError('User memory limit exceeded.'))
+    flight = singleflight.SingleFlight()
+
+    results, errors = run_concurrently(16, lambda: flight.do('landuse', backend.get_map_id, 'landuse'))
+
+    assert backend.calls == 1
+    assert all(isinstance(e, ValueError) for e in errors)
+
+
+def test_different_keys_are_not_coalesced():
+    backend = SlowBackend(delay=0.05)
+    flight = singleflight.SingleFlight()
+
+    keys = ['satellite', 'ndvi', 'landuse', 'legger']
+    index = iter(range(len(keys)))
+    lock = threading.Lock()
+
+    def call():
+        with lock:
+            key = keys[next(index)]
+        return flight.do(key, backend.get_map_id, key)
+
+    results, errors = run_concurrently(len(keys), call)
+
+    assert backend.calls == len(keys)
+    assert sorted(results) == sorted('mapid-' + k for k in keys)
+
+
+def test_sequential_calls_are_not_coalesced():
+    backend = SlowBackend(delay=0, error=ValueError('failed'))
+    flight = singleflight.SingleFlight()
+
+    for i in range(3):
+        with pytest.raises(ValueError):
+            flight.do('landuse', backend.get_map_id, 'landuse')
+
+    assert backend.calls == 3
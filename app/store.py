@@ -0,0 +1,164 @@
+'''Persistent stores for zonal statistics which do not change once computed.'''
+import hashlib
+import json
+import sqlite3
+import threading
+
+
+class ZonalStore(object):
+    """
+    Stores zonal statistics per (feature geometry hash, collection, period, scale, version) in a sqlite
+    database.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+
+        with self._lock, self._connection:
+            self._connection.execute(
+                'CREATE TABLE IF NOT EXISTS zonal_statistics ('
+                'geometry TEXT NOT NULL, '
+                'collection TEXT NOT NULL, '
+                'period TEXT NOT NULL, '
+                'scale REAL NOT NULL, '
+                'version INTEGER NOT NULL, '
+                'value TEXT NOT NULL, '
+                'PRIMARY KEY (geometry, collection, period, scale, version))')
+
+    def get_many(self, geometries, collection, scale, periods=None, version=0):
+        """
+        Returns stored values for all periods of the given geometries
+        :param geometries: geometry hashes
+        :param collection:
+        :param scale:
+        :param periods: not used, all periods are returned
+        :param version: version of the computation, values of other versions are ignored
+        :return: {(geometry, period): value}
+        """
+        geometries = list(set(geometries))
+
+        values = {}
+
+        # stay below the maximum number of sqlite query parameters
+        for i in range(0, len(geometries), 500):
+            chunk = geometries[i:i + 500]
+
+            query = 'SELECT geometry, period, value FROM zonal_statistics ' \
+                    'WHERE collection = ? AND scale = ? AND version = ? AND geometry IN ({0})' \
+                .format(','.join('?' * len(chunk)))
+
+            with self._lock:
+                rows = self._connection.execute(query, [collection, scale, version] + chunk).fetchall()
+
+            for geometry, period, value in rows:
+                values[(geometry, period)] = json.loads(value)
+
+        return values
+
+    def put_many(self, collection, period, scale, values, version=0):
+        """
+        :param collection:
+        :param period:
+        :param scale:
+        :param values: {geometry: value}
+        :param version: version of the computation
+        """
+        rows = [(geometry, collection, period, scale, version, json.dumps(value)) for geometry, value in values.items()]
+
+        with self._lock, self._connection:
+            self._connection.executemany('INSERT OR REPLACE INTO zonal_statistics VALUES (?, ?, ?, ?, ?, ?)', rows)
+
+
+class FirestoreZonalStore(object):
+    """
+    Stores zonal statistics in a Firestore collection, one document per (feature geometry hash, collection,
+    scale, version) with the values of all periods, so that reading the periods of a feature is a single
+    document read. Shared by all instances and kept across restarts.
+    """
+
+    def __init__(self, get_client, collection_name):
+        """
+        :param get_client: function(), returns a Firestore client, called on first use
+        :param collection_name: Firestore collection
+        """
+        self.get_client = get_client
+        self.collection_name = collection_name
+
+        self._client = None
+        self._lock = threading.Lock()
+
+    def _get_client(self):
+        with self._lock:
+            if self._client is None:
+                self._client = self.get_client()
+
+            return self._client
+
+    @staticmethod
+    def _get_document_id(geometry, collection, scale, version):
+        key = [geometry, collection, scale, version]
+
+        return hashlib.sha1(json.dumps(key).encode('utf-8')).hexdigest()
+
+    def get_many(self, geometries, collection, scale, periods=None, version=0):
+        """
+        Returns stored values for all periods of the given geometries
+        :param geometries: geometry hashes
+        :param collection:
+        :param scale:
+        :param periods: not used, all periods are returned
+        :param version: version of the computation, values of other versions are ignored
+        :return: {(geometry, period): value}
+        """
+        client = self._get_client()
+        ref = client.collection(self.collection_name)
+
+        geometries = list(set(geometries))
+
+        values = {}
+
+        for i in range(0, len(geometries), 300):
+            refs = [ref.document(self._get_document_id(g, collection, scale, version)) for g in geometries[i:i + 300]]
+
+            for document in client.get_all(refs):
+                if not document.exists:
+                    continue
+
+                d = document.to_dict()
+
+                for period, value in d['values'].items():
+                    values[(d['geometry'], period)] = json.loads(value)
+
+        return values
+
+    def put_many(self, collection, period, scale, values, version=0):
+        """
+        Adds the values of a period to the documents of the geometries
+        :param collection:
+        :param period:
+        :param scale:
+        :param values: {geometry: value}
+        :param version: version of the computation
+        """
+        client = self._get_client()
+        ref = client.collection(self.collection_name)
+
+        items = list(values.items())
+
+        # at most 500 writes per batch, values of other periods are kept by merging
+        for i in range(0, len(items), 500):
+            batch = client.batch()
+
+            for geometry, value in items[i:i + 500]:
+                batch.set(ref.document(self._get_document_id(geometry, collection, scale, version)), {
+                    'geometry': geometry,
+                    'collection': collection,
+                    'scale': scale,
+                    'version': version,
+                    'values': {period: json.dumps(value)}
+                }, merge=True)
+
+            batch.commit()
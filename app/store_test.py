@@ -0,0 +1,119 @@
+from . import store
+
+
+def test_zonal_store_persists_values(tmpdir):
+    path = str(tmpdir.join('zonal.sqlite'))
+
+    s = store.ZonalStore(path)
+    s.put_many('yearly-classified-images', '2017', 30, {
+        'geometry1': [{'type': 1, 'sum': 100.0}],
+        'geometry2': []
+    })
+    s.put_many('yearly-classified-images', '2018', 30, {
+        'geometry1': [{'type': 3, 'sum': 50.0}]
+    })
+    s.put_many('yearly-classified-images', '2018', 10, {
+        'geometry1': [{'type': 3, 'sum': 55.0}]
+    })
+
+    s.put_many('yearly-classified-images', '2018', 30, {
+        'geometry2': [{'type': 3, 'sum': 60.0}]
+    }, version=1)
+
+    s = store.ZonalStore(path)
+    values = s.get_many(['geometry1', 'geometry2', 'geometry3'], 'yearly-classified-images', 30)
+
+    assert values == {
+        ('geometry1', '2017'): [{'type': 1, 'sum': 100.0}],
+        ('geometry2', '2017'): [],
+        ('geometry1', '2018'): [{'type': 3, 'sum': 50.0}]
+    }
+
+    values = s.get_many(['geometry2'], 'yearly-classified-images', 30, version=1)
+
+    assert values == {('geometry2', '2018'): [{'type': 3, 'sum': 60.0}]}
+
+
+class FakeDocument(object):
+    def __init__(self, data):
+        self.exists = data is not None
+        self.data = data
+
+    def to_dict(self):
+        return dict(self.data)
+
+
+class FakeBatch(object):
+    def __init__(self, client):
+        self.client = client
+        self.writes = []
+
+    def set(self, reference, data, merge=False):
+        self.writes.append((reference, data, merge))
+
+    def commit(self):
+        for reference, data, merge in self.writes:
+            document = self.client.documents.get(reference) if merge else None
+            self.client.documents[reference] = merge_document(document or {}, data)
+
+
+def merge_document(document, data):
+    merged = dict(document)
+
+    for k, v in data.items():
+        merged[k] = merge_document(merged.get(k, {}), v) if isinstance(v, dict) else v
+
+    return merged
+
+
+class FakeCollection(object):
+    def __init__(self, name):
+        self.name = name
+
+    def document(self, id):
+        return self.name + '/' + id
+
+
+class FakeClient(object):
+    def __init__(self):
+        self.documents = {}
+        self.reads = 0
+
+    def collection(self, name):
+        return FakeCollection(name)
+
+    def batch(self):
+        return FakeBatch(self)
+
+    def get_all(self, references):
+        self.reads += len(references)
+
+        return [FakeDocument(self.documents.get(r)) for r in references]
+
+
+def test_firestore_zonal_store():
+    client = FakeClient()
+
+    s = store.FirestoreZonalStore(lambda: client, 'zonal')
+    s.put_many('yearly-classified-images', '2017/a', 30, {
+        'geometry1': [{'type': 1, 'sum': 100.0}],
+        'geometry2': []
+    })
+    s.put_many('yearly-classified-images', '2017/b', 30, {
+        'geometry1': [{'type': 3, 'sum': 50.0}]
+    })
+
+    values = s.get_many(['geometry1', 'geometry2'], 'yearly-classified-images', 30, ['2017/a', '2017/b', '2018/c'])
+
+    assert values == {
+        ('geometry1', '2017/a'): [{'type': 1, 'sum': 100.0}],
+        ('geometry2', '2017/a'): [],
+        ('geometry1', '2017/b'): [{'type': 3, 'sum': 50.0}]
+    }
+
+    # one document per geometry
+    assert len(client.documents) == 2
+    assert client.reads == 2
+
+    assert s.get_many(['geometry1'], 'yearly-classified-images', 10, ['2017/a']) == {}
+    assert s.get_many(['geometry1'], 'yearly-classified-images', 30, ['2017/a'], version=1) == {}
@@ -0,0 +1,435 @@
+'''Queries of the s2-tile-cache Firestore collection by rectangles of z10 tiles.'''
+import itertools
+import math
+import time
+from collections import defaultdict
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import numpy as np
+
+day_millis = 24 * 60 * 60 * 1000
+
+
+def compound_tile_index(tx, ty):
+    return tx * 100000 + ty
+
+
+def get_tile_xy(lon, lat, zoom=10):
+    """
+    Returns x and y of the slippy map (XYZ) tile at a location
+    """
+    n = 2 ** zoom
+    lat = math.radians(max(min(lat, 85.0511), -85.0511))
+
+    tx = int(math.floor((lon + 180.0) / 360.0 * n))
+    ty = int(math.floor((1.0 - math.log(math.tan(lat) + 1.0 / math.cos(lat)) / math.pi) / 2.0 * n))
+
+    return min(max(tx, 0), n - 1), min(max(ty, 0), n - 1)
+
+
+def get_tile_key(tx, ty):
+    return '{0}_{1}'.format(int(tx), int(ty))
+
+
+def get_tile_image_id(tile_image):
+    """
+    Returns a deterministic document id of a tile image record, rewriting a record replaces it
+    """
+    return '{0}_{1}'.format(get_tile_key(tile_image['tx'], tile_image['ty']), tile_image['image_id'].split('/')[-1])
+
+
+def get_tile_thresholds(tile_images, thresholds=None):
+    """
+    Returns the highest quality score of the selected images per tile, images with a lower or equal
+    score are accepted in incremental updates
+    :param tile_images: list of {'tx': ..., 'ty': ..., 'quality_score': ...}
+    :param thresholds: thresholds of previous tile images, updated in place
+    :return: {tile key: quality score}
+    """
+    if thresholds is None:
+        thresholds = {}
+
+    for tile_image in tile_images:
+        score = tile_image.get('quality_score')
+
+        if score is None:
+            continue
+
+        key = get_tile_key(tile_image['tx'], tile_image['ty'])
+        thresholds[key] = max(score, thresholds.get(key, score))
+
+    return thresholds
+
+
+def _common_prefix_length(a, b):
+    n = 0
+    for x, y in zip(a, b):
+        if x != y:
+            break
+        n += 1
+
+    return n
+
+
+def encode_tile(tile_images):
+    """
+    Returns a compact document with all images of a single tile. Image times are sorted and delta-encoded,
+    image ids are front-coded ('<length of prefix shared with the previous id>:<suffix>').
+    :param tile_images: list of {'tx': ..., 'ty': ..., 'image_time': ..., 'image_id': ..., 'quality_score': ...}
+    :return: {'tx': ..., 'ty': ..., 'txty': ..., 'times': [...], 'ids': [...], 'quality_scores': [...]}
+    """
+    tile_images = sorted(tile_images, key=lambda t: (t['image_time'], t['image_id']))
+
+    tx, ty = tile_images[0]['tx'], tile_images[0]['ty']
+
+    times = []
+    ids = []
+    previous_time = 0
+    previous_id = ''
+    for tile_image in tile_images:
+        times.append(tile_image['image_time'] - previous_time)
+
+        n = _common_prefix_length(previous_id, tile_image['image_id'])
+        ids.append('{0}:{1}'.format(n, tile_image['image_id'][n:]))
+
+        previous_time = tile_image['image_time']
+        previous_id = tile_image['image_id']
+
+    return {
+        'tx': tx,
+        'ty': ty,
+        'txty': compound_tile_index(tx, ty),
+        'times': times,
+        'ids': ids,
+        'quality_scores': [t.get('quality_score') for t in tile_images]
+    }
+
+
+def decode_times(times):
+    """
+    Returns image times of a compact tile document, see encode_tile()
+    """
+    return list(itertools.accumulate(times))
+
+
+def decode_tile(tile):
+    """
+    Returns tile image records of a compact tile document, see encode_tile()
+    """
+    tile_images = []
+
+    times = decode_times(tile['times'])
+    scores = tile.get('quality_scores') or [None] * len(times)
+
+    image_id = ''
+    for image_time, id, score in zip(times, tile['ids'], scores):
+        n, suffix = id.split(':', 1)
+        image_id = image_id[:int(n)] + suffix
+
+        tile_images.append({
+            'tx': tile['tx'],
+            'ty': tile['ty'],
+            'image_time': image_time,
+            'image_id': image_id,
+            'quality_score': score
+        })
+
+    return tile_images
+
+
+def group_tiles(tile_images):
+    """
+    Returns compact documents per tile key, see encode_tile()
+    """
+    tiles = defaultdict(list)
+    for tile_image in tile_images:
+        tiles[get_tile_key(tile_image['tx'], tile_image['ty'])].append(tile_image)
+
+    return {key: encode_tile(t) for key, t in tiles.items()}
+
+
+def merge_tile_images(tile_images, new_tile_images, time_min):
+    """
+    Returns tile images with new tile images added or replacing images with the same id, images acquired
+    before time_min are removed
+    """
+    merged = {t['image_id']: t for t in tile_images}
+    merged.update((t['image_id'], t) for t in new_tile_images)
+
+    return [t for t in merged.values() if t['image_time'] >= time_min]
+
+
+def get_tile_cache_stats(tile_images):
+    """
+    Returns aggregate statistics of tile image records
+    :param tile_images: iterable of {'tx': ..., 'ty': ..., 'image_time': ...}
+    :return: {'count': ..., 'tiles': {tile key: count}, 'time_min': ..., 'time_max': ...}
+    """
+    tiles = defaultdict(int)
+    time_min = None
+    time_max = None
+
+    for tile_image in tile_images:
+        tiles[get_tile_key(tile_image['tx'], tile_image['ty'])] += 1
+
+        t = tile_image['image_time']
+        time_min = t if time_min is None else min(time_min, t)
+        time_max = t if time_max is None else max(time_max, t)
+
+    return {
+        'count': sum(tiles.values()),
+        'tiles': dict(tiles),
+        'time_min': time_min,
+        'time_max': time_max
+    }
+
+
+def merge_tile_cache_stats(stats_list):
+    """
+    Returns aggregate statistics of disjoint sets of tiles, e.g. of the chunks of an update
+    :param stats_list: list of statistics, see get_tile_cache_stats()
+    :return: {'count': ..., 'tiles': {tile key: count}, 'time_min': ..., 'time_max': ...}
+    """
+    tiles = {}
+    for stats in stats_list:
+        tiles.update(stats['tiles'])
+
+    times_min = [stats['time_min'] for stats in stats_list if stats['time_min'] is not None]
+    times_max = [stats['time_max'] for stats in stats_list if stats['time_max'] is not None]
+
+    return {
+        'count': sum(tiles.values()),
+        'tiles': tiles,
+        'time_min': min(times_min) if times_min else None,
+        'time_max': max(times_max) if times_max else None
+    }
+
+
+def iter_pages(get_page, page_size):
+    """
+    Yields pages of a collection until a page is not full
+    :param get_page: function(offset, count), returns a list of at most count items
+    :param page_size: items per page
+    """
+    offset = 0
+
+    while True:
+        page = get_page(offset, page_size)
+
+        if page:
+            yield page
+
+        if len(page) < page_size:
+            return
+
+        offset += page_size
+
+
+def run_chunks(fn, chunks, completed, max_workers, time_budget=None):
+    """
+    Calls fn(index, chunk) concurrently for all chunks which are not completed yet. No new chunks are
+    started once the time budget is used, remaining chunks are left for a next run.
+    :param fn: function(index, chunk), called once per chunk, records its own checkpoint
+    :param chunks: list of chunks
+    :param completed: indices of chunks completed by a previous run
+    :param max_workers: maximum number of concurrent chunks
+    :param time_budget: seconds after which no new chunks are started
+    :return: indices of chunks completed by this run
+    """
+    started = time.time()
+    pending = [i for i in range(len(chunks)) if i not in completed]
+    done = []
+    error = None
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        running = {}
+
+        while pending or running:
+            can_start = error is None and (time_budget is None or time.time() - started < time_budget)
+
+            while can_start and pending and len(running) < max_workers:
+                i = pending.pop(0)
+                running[executor.submit(fn, i, chunks[i])] = i
+
+            if not running:
+                break
+
+            finished, _ = wait(list(running), return_when=FIRST_COMPLETED)
+
+            for future in finished:
+                i = running.pop(future)
+
+                try:
+                    future.result()
+                    done.append(i)
+                except Exception as e:
+                    error = error or e
+
+    if error is not None:
+        raise error
+
+    return sorted(done)
+
+
+def get_tile_ranges(tiles_min, tiles_max):
+    """
+    Returns compound tile index ranges covering a rectangle of tiles, one range per tile column
+    :param tiles_min: {'tx': ..., 'ty': ...}
+    :param tiles_max: {'tx': ..., 'ty': ...}
+    :return: list of (txty_min, txty_max), inclusive
+    """
+    tx_min, tx_max = sorted([tiles_min['tx'], tiles_max['tx']])
+    ty_min, ty_max = sorted([tiles_min['ty'], tiles_max['ty']])
+
+    return [(compound_tile_index(tx, ty_min), compound_tile_index(tx, ty_max)) for tx in range(tx_min, tx_max + 1)]
+
+
+def query_tiles(collection, tiles_min, tiles_max, fields, max_workers=8):
+    """
+    Returns documents within a rectangle of tiles. A single range query on the compound index would
+    also read all documents of the intermediate columns outside of the rectangle, instead one range
+    query is made per column, queries are executed concurrently.
+    :param collection: Firestore collection reference, documents have a txty field
+    :param tiles_min: {'tx': ..., 'ty': ...}
+    :param tiles_max: {'tx': ..., 'ty': ...}
+    :param fields: fields to select
+    :param max_workers: maximum number of concurrent queries
+    :return: list of document dictionaries
+    """
+
+    def query(tile_range):
+        txty_min, txty_max = tile_range
+
+        documents = collection.where(u'txty', u'>=', txty_min).where(u'txty', u'<=', txty_max) \
+            .select(fields).stream()
+
+        return [d.to_dict() for d in documents]
+
+    ranges = get_tile_ranges(tiles_min, tiles_max)
+
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(ranges))) as executor:
+        return [d for documents in executor.map(query, ranges) for d in documents]
+
+
+class TileTimesIndex(object):
+    """
+    Acquisition days per z10 tile, stored as one bitset per tile. Answers tile rectangle queries in
+    memory, without Firestore reads.
+    """
+
+    def __init__(self, tile_images):
+        """
+        :param tile_images: iterable of {'tx': ..., 'ty': ..., 'image_time': ...}, image_time in milliseconds
+        """
+        tile_days = defaultdict(set)
+        for tile_image in tile_images:
+            tile_days[(tile_image['tx'], tile_image['ty'])].add(tile_image['image_time'] // day_millis)
+
+        days = [day for d in tile_days.values() for day in d]
+
+        self.day_min = min(days) if days else 0
+        self.day_count = max(days) - self.day_min + 1 if days else 0
+
+        tile_keys = list(tile_days.keys())
+        self._tx = np.array([tx for tx, _ in tile_keys], dtype=np.int64)
+        self._ty = np.array([ty for _, ty in tile_keys], dtype=np.int64)
+
+        bits = np.zeros((len(tile_keys), self.day_count), dtype=bool)
+        for i, tile in enumerate(tile_keys):
+            bits[i, np.array(sorted(tile_days[tile])) - self.day_min] = True
+
+        self._bits = np.packbits(bits, axis=1)
+
+    def __len__(self):
+        return len(self._tx)
+
+    def query(self, tiles_min, tiles_max):
+        """
+        Returns days with images for any of the tiles within a rectangle
+        :param tiles_min: {'tx': ..., 'ty': ...}
+        :param tiles_max: {'tx': ..., 'ty': ...}
+        :return: sorted list of times (milliseconds, start of the UTC day)
+        """
+        tx_min, tx_max = sorted([tiles_min['tx'], tiles_max['tx']])
+        ty_min, ty_max = sorted([tiles_min['ty'], tiles_max['ty']])
+
+        rows = np.flatnonzero((self._tx >= tx_min) & (self._tx <= tx_max) & (self._ty >= ty_min) & (self._ty <= ty_max))
+
+        if not len(rows):
+            return []
+
+        bits = np.bitwise_or.reduce(self._bits[rows], axis=0)
+        days = np.flatnonzero(np.unpackbits(bits)[:self.day_count])
+
+        return [(int(day) + self.day_min) * day_millis for day in days]
+
+
+class ImageQualityIndex(object):
+    """
+    Quality scores of all images per z10 tile, used to select mostly cloud-free images of a region
+    without computing quality scores in EE.
+    """
+
+    def __init__(self, tiles, time_begin, time_end):
+        """
+        :param tiles: list of compact tile documents, see encode_tile()
+        :param time_begin: begin of the period covered by the scores (milliseconds)
+        :param time_end: end of the period covered by the scores (milliseconds)
+        """
+        self.time_begin = time_begin
+        self.time_end = time_end
+
+        self._tiles = {get_tile_key(t['tx'], t['ty']): decode_tile(t) for t in tiles}
+
+    def __len__(self):
+        return len(self._tiles)
+
+    def select(self, bounds, time_begin, time_end, cloud_frequency):
+        """
+        Returns ids of the images with the best quality score, the same way as get_mostly_clean_images():
+        the cleanest (1 - cloud_frequency) part of the images intersecting the bounds.
+
+        get_mostly_clean_images() scores an image by the 95th percentile of its cloud score within the region,
+        stored scores are the 95th percentile within each tile. The score of an image is the highest score of
+        the tiles within the bounds, an upper bound of the percentile within these tiles (at most 5% of the
+        pixels of each tile, and so of all tiles, exceed it). Images are ranked by their worst tile, for a
+        region within a single tile this is the percentile within the tile.
+        :param bounds: [xmin, ymin, xmax, ymax] in longitude, latitude
+        :param time_begin: milliseconds
+        :param time_end: milliseconds, exclusive
+        :param cloud_frequency: expected fraction of cloudy images
+        :return: list of image ids, or None if the scores do not cover the bounds or the period, or if no
+        images are selected
+        """
+        if time_begin < self.time_begin or time_end > self.time_end:
+            return None
+
+        tx_min, ty_max = get_tile_xy(bounds[0], bounds[1])
+        tx_max, ty_min = get_tile_xy(bounds[2], bounds[3])
+
+        tile_keys = [get_tile_key(tx, ty) for tx in range(tx_min, tx_max + 1) for ty in range(ty_min, ty_max + 1)]
+        tile_keys = [key for key in tile_keys if key in self._tiles]
+
+        if not tile_keys:
+            return None
+
+        # quality_score is missing if an image has no pixels in a tile
+        scores = {}
+        for key in tile_keys:
+            for tile_image in self._tiles[key]:
+                score = tile_image['quality_score']
+
+                if score is None or not time_begin <= tile_image['image_time'] < time_end:
+                    continue
+
+                scores[tile_image['image_id']] = max(score, scores.get(tile_image['image_id'], score))
+
+        max_image_count = int(len(scores) * (1 - cloud_frequency))
+
+        ranked = sorted((score, id) for id, score in scores.items())[:max_image_count]
+
+        # an empty list would select no images at all, EE is used instead
+        if not ranked:
+            return None
+
+        return [id for _, id in ranked]
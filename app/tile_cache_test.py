@@ -0,0 +1,261 @@
+import pytest
+
+from . import tile_cache
+
+
+class FakeDocument(object):
+    def __init__(self, data):
+        self.data = data
+
+    def to_dict(self):
+        return dict(self.data)
+
+
+class FakeQuery(object):
+    def __init__(self, documents, filters=()):
+        self.documents = documents
+        self.filters = filters
+
+    def where(self, field, op, value):
+        return FakeQuery(self.documents, self.filters + ((field, op, value),))
+
+    def select(self, fields):
+        return self
+
+    def stream(self):
+        ops = {'>=': lambda a, b: a >= b, '<=': lambda a, b: a <= b}
+
+        for d in self.documents:
+            if all(ops[op](d[field], value) for field, op, value in self.filters):
+                self.documents.reads += 1
+                yield FakeDocument(d)
+
+
+class FakeDocuments(list):
+    reads = 0
+
+
+def _get_collection(tx_range, ty_range):
+    documents = FakeDocuments()
+
+    for tx in tx_range:
+        for ty in ty_range:
+            txty = tile_cache.compound_tile_index(tx, ty)
+            documents.append({'tx': tx, 'ty': ty, 'txty': txty, 'image_time': tx + ty})
+
+    return FakeQuery(documents)
+
+
+def test_get_tile_ranges():
+    ranges = tile_cache.get_tile_ranges({'tx': 526, 'ty': 338}, {'tx': 525, 'ty': 336})
+
+    assert ranges == [(52500336, 52500338), (52600336, 52600338)]
+
+
+def test_query_tiles_reads_only_rectangle():
+    collection = _get_collection(range(520, 530), range(330, 350))
+
+    documents = tile_cache.query_tiles(collection, {'tx': 522, 'ty': 335}, {'tx': 524, 'ty': 336}, ['image_time'])
+
+    assert sorted((d['tx'], d['ty']) for d in documents) == \
+        [(tx, ty) for tx in range(522, 525) for ty in range(335, 337)]
+    assert collection.documents.reads == 6
+
+
+def test_tile_times_index_query():
+    day = tile_cache.day_millis
+    tile_images = [
+        {'tx': 520, 'ty': 330, 'image_time': 17000 * day + 1000},
+        {'tx': 520, 'ty': 330, 'image_time': 17005 * day + 1000},
+        {'tx': 521, 'ty': 330, 'image_time': 17005 * day + 2000},
+        {'tx': 522, 'ty': 331, 'image_time': 17012 * day}
+    ]
+
+    index = tile_cache.TileTimesIndex(tile_images)
+
+    assert len(index) == 3
+    assert index.query({'tx': 520, 'ty': 330}, {'tx': 521, 'ty': 330}) == [17000 * day, 17005 * day]
+    assert index.query({'tx': 522, 'ty': 332}, {'tx': 520, 'ty': 330}) == [17000 * day, 17005 * day, 17012 * day]
+    assert index.query({'tx': 530, 'ty': 330}, {'tx': 531, 'ty': 331}) == []
+    assert tile_cache.TileTimesIndex([]).query({'tx': 0, 'ty': 0}, {'tx': 1, 'ty': 1}) == []
+
+
+def test_get_tile_image_id():
+    tile_image = {'tx': 525, 'ty': 336, 'image_id': 'COPERNICUS/S2/20190101T105441_20190101T105443_T31UFT'}
+
+    assert tile_cache.get_tile_image_id(tile_image) == '525_336_20190101T105441_20190101T105443_T31UFT'
+
+
+def test_get_tile_thresholds():
+    tile_images = [
+        {'tx': 525, 'ty': 336, 'quality_score': 0.12},
+        {'tx': 525, 'ty': 336, 'quality_score': 0.08},
+        {'tx': 526, 'ty': 336, 'quality_score': 0.05},
+        {'tx': 527, 'ty': 336, 'quality_score': None}
+    ]
+
+    assert tile_cache.get_tile_thresholds(tile_images) == {'525_336': 0.12, '526_336': 0.05}
+    assert tile_cache.get_tile_thresholds(tile_images[1:], {'525_336': 0.2}) == {'525_336': 0.2, '526_336': 0.05}
+
+
+def test_iter_pages():
+    items = list(range(25))
+    calls = []
+
+    def get_page(offset, count):
+        calls.append(offset)
+        return items[offset:offset + count]
+
+    assert list(tile_cache.iter_pages(get_page, 10)) == [items[0:10], items[10:20], items[20:25]]
+    assert calls == [0, 10, 20]
+
+    assert list(tile_cache.iter_pages(lambda offset, count: items[offset:offset + count], 5))[-1] == items[20:25]
+
+
+def test_run_chunks_skips_completed_chunks():
+    calls = []
+
+    def fn(i, chunk):
+        calls.append((i, chunk))
+
+    done = tile_cache.run_chunks(fn, [['a'], ['b'], ['c'], ['d']], completed={1, 3}, max_workers=2)
+
+    assert done == [0, 2]
+    assert sorted(calls) == [(0, ['a']), (2, ['c'])]
+
+
+def test_run_chunks_stops_after_time_budget():
+    done = tile_cache.run_chunks(lambda i, chunk: None, [[1], [2], [3]], completed=set(), max_workers=1,
+                                 time_budget=0)
+
+    assert done == []
+
+
+def test_run_chunks_raises_error_of_chunk():
+    def fn(i, chunk):
+        if i == 1:
+            raise ValueError(chunk)
+
+    with pytest.raises(ValueError):
+        tile_cache.run_chunks(fn, [[1], [2], [3]], completed=set(), max_workers=2)
+
+
+def test_get_tile_cache_stats():
+    tile_images = [
+        {'tx': 520, 'ty': 330, 'image_time': 3000},
+        {'tx': 520, 'ty': 330, 'image_time': 1000},
+        {'tx': 521, 'ty': 330, 'image_time': 2000}
+    ]
+
+    assert tile_cache.get_tile_cache_stats(tile_images) == {
+        'count': 3,
+        'tiles': {'520_330': 2, '521_330': 1},
+        'time_min': 1000,
+        'time_max': 3000
+    }
+
+    assert tile_cache.get_tile_cache_stats([])['count'] == 0
+
+
+def test_merge_tile_cache_stats():
+    stats = tile_cache.merge_tile_cache_stats([
+        tile_cache.get_tile_cache_stats([{'tx': 520, 'ty': 330, 'image_time': 3000}]),
+        tile_cache.get_tile_cache_stats([]),
+        tile_cache.get_tile_cache_stats([{'tx': 521, 'ty': 330, 'image_time': 2000},
+                                         {'tx': 521, 'ty': 330, 'image_time': 1000}])
+    ])
+
+    assert stats == {
+        'count': 3,
+        'tiles': {'520_330': 1, '521_330': 2},
+        'time_min': 1000,
+        'time_max': 3000
+    }
+
+
+def test_encode_decode_tile():
+    tile_images = [
+        {'tx': 525, 'ty': 336, 'image_time': 1546340081000, 'quality_score': 0.1,
+         'image_id': 'COPERNICUS/S2/20190101T105441_20190101T105443_T31UFT'},
+        {'tx': 525, 'ty': 336, 'image_time': 1545908081000, 'quality_score': 0.2,
+         'image_id': 'COPERNICUS/S2/20181227T105441_20181227T105443_T31UFT'},
+        {'tx': 525, 'ty': 336, 'image_time': 1546340081000, 'quality_score': 0.3,
+         'image_id': 'COPERNICUS/S2/20190101T105441_20190101T105443_T31UGT'}
+    ]
+
+    tile = tile_cache.encode_tile(tile_images)
+
+    assert tile['txty'] == 52500336
+    assert tile['times'] == [1545908081000, 432000000, 0]
+    assert tile['ids'] == ['0:COPERNICUS/S2/20181227T105441_20181227T105443_T31UFT',
+                           '17:90101T105441_20190101T105443_T31UFT',
+                           '50:GT']
+
+    assert tile_cache.decode_times(tile['times']) == [1545908081000, 1546340081000, 1546340081000]
+
+    decoded = tile_cache.decode_tile(tile)
+    assert decoded == sorted(tile_images, key=lambda t: (t['image_time'], t['image_id']))
+
+
+def test_group_tiles():
+    tile_images = [
+        {'tx': 525, 'ty': 336, 'image_time': 2000, 'image_id': 'b'},
+        {'tx': 526, 'ty': 336, 'image_time': 1000, 'image_id': 'a'},
+        {'tx': 525, 'ty': 336, 'image_time': 1000, 'image_id': 'a'}
+    ]
+
+    tiles = tile_cache.group_tiles(tile_images)
+
+    assert sorted(tiles) == ['525_336', '526_336']
+    assert tiles['525_336']['times'] == [1000, 1000]
+    assert [t['image_id'] for t in tile_cache.decode_tile(tiles['525_336'])] == ['a', 'b']
+
+
+def test_get_tile_xy():
+    # Utrecht
+    assert tile_cache.get_tile_xy(5.12, 52.09) == (526, 337)
+
+
+def test_merge_tile_images():
+    tile_images = [
+        {'image_id': 'a', 'image_time': 1000, 'quality_score': 0.1},
+        {'image_id': 'b', 'image_time': 2000, 'quality_score': 0.2}
+    ]
+    new_tile_images = [
+        {'image_id': 'b', 'image_time': 2000, 'quality_score': 0.3},
+        {'image_id': 'c', 'image_time': 3000, 'quality_score': 0.4}
+    ]
+
+    merged = tile_cache.merge_tile_images(tile_images, new_tile_images, 1500)
+
+    assert sorted((t['image_id'], t['quality_score']) for t in merged) == [('b', 0.3), ('c', 0.4)]
+
+
+def test_image_quality_index_select():
+    def tile(tx, ty, scores):
+        return tile_cache.encode_tile([
+            {'tx': tx, 'ty': ty, 'image_time': 1000 * (i + 1), 'image_id': 'S2/{0}'.format(i), 'quality_score': s}
+            for i, s in enumerate(scores)])
+
+    tiles = [
+        tile(526, 337, [0.5, 0.1, 0.3, None, 0.2, 0.9, 0.4, 0.8, 0.6, 0.7]),
+        tile(527, 337, [0.5, 0.1, 0.3, None, 0.2, 0.9, 0.4, 0.8, 0.6, 0.05])
+    ]
+
+    index = tile_cache.ImageQualityIndex(tiles, 0, 20000)
+
+    # single tile, 9 images with a score, 2 cleanest
+    assert index.select([5.12, 52.09, 5.13, 52.10], 0, 20000, 0.7) == ['S2/1', 'S2/4']
+
+    # both tiles, highest score of an image is used
+    assert index.select([5.12, 52.09, 5.5, 52.10], 0, 20000, 0.7) == ['S2/1', 'S2/4']
+
+    # time range
+    assert index.select([5.12, 52.09, 5.13, 52.10], 5000, 11000, 0.5) == ['S2/4', 'S2/6', 'S2/8']
+
+    # no images selected
+    assert index.select([5.12, 52.09, 5.13, 52.10], 0, 20000, 0.95) is None
+
+    # not covered
+    assert index.select([5.12, 52.09, 5.13, 52.10], 0, 30000, 0.7) is None
+    assert index.select([9.0, 52.09, 9.1, 52.10], 0, 20000, 0.7) is None
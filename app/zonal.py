@@ -0,0 +1,180 @@
+'''Chunked evaluation of zonal statistics for large feature collections.'''
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import numpy as np
+
+
+def iter_chunks(items, chunk_size):
+    """
+    Splits items into lists of at most chunk_size items
+    """
+    chunk = []
+
+    for item in items:
+        chunk.append(item)
+
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+
+    if chunk:
+        yield chunk
+
+
+def imap_chunks(fn, items, chunk_size=100, max_workers=4):
+    """
+    Evaluates fn for chunks of items in a bounded thread pool and yields results per item,
+    in the order of items. fn must return a list with one result per item in a chunk.
+    At most 2 * max_workers chunks are evaluated ahead of the consumer.
+    :param fn: function evaluating a list of items, e.g. one EE getInfo() call
+    :param items: iterable of items
+    :param chunk_size: number of items per call
+    :param max_workers: maximum number of concurrent calls
+    :return: generator of results
+    """
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pending = deque()
+
+        for chunk in iter_chunks(items, chunk_size):
+            pending.append(executor.submit(fn, chunk))
+
+            if len(pending) >= 2 * max_workers:
+                for result in pending.popleft().result():
+                    yield result
+
+        while pending:
+            for result in pending.popleft().result():
+                yield result
+
+
+def imap_cached(fn, items, keys, results_cache, chunk_size=100, max_workers=4, ttl=None):
+    """
+    Same as imap_chunks(), but takes results from cache where possible. Only items missing
+    from the cache are evaluated, results are merged in the order of items.
+    :param fn: function evaluating a list of items
+    :param items: list of items
+    :param keys: cache key per item
+    :param results_cache: cache.TTLCache
+    :param chunk_size: number of items per call
+    :param max_workers: maximum number of concurrent calls
+    :param ttl: time-to-live of new cache entries, defaults to ttl of the cache
+    :return: generator of results
+    """
+    results = [results_cache.get(key) for key in keys]
+
+    missing = [item for item, result in zip(items, results) if result is None]
+    computed = imap_chunks(fn, missing, chunk_size, max_workers)
+
+    for key, result in zip(keys, results):
+        if result is None:
+            result = next(computed)
+            results_cache.set(key, result, ttl)
+
+        yield result
+
+
+def _add_months(t, months):
+    month = t.month - 1 + months
+
+    return datetime(t.year + month // 12, month % 12 + 1, 1)
+
+
+def get_periods(date_begin, date_end, period):
+    """
+    Splits a time range into months or (meteorological) seasons
+    :param date_begin: datetime
+    :param date_end: datetime
+    :param period: 'month' or 'season'
+    :return: list of (begin, end) of periods overlapping the time range
+    """
+    begin = datetime(date_begin.year, date_begin.month, 1)
+    months = 1
+
+    if period == 'season':
+        # seasons start in December, March, June and September
+        begin = _add_months(begin, -(begin.month % 3))
+        months = 3
+
+    periods = []
+    while begin < date_end:
+        end = _add_months(begin, months)
+        periods.append((begin, end))
+        begin = end
+
+    return periods
+
+
+def format_groups(groups):
+    """
+    Formats output of a grouped sum reducer as area per type
+    :param groups: [{'type': 1, 'sum': 100.0}, ...]
+    :return: [{'type': '1', 'area': 100.0}, ...]
+    """
+    return [{'type': '%d' % g['type'], 'area': g['sum']} for g in groups]
+
+
+def format_transitions(groups, classes):
+    """
+    Formats output of a grouped sum reducer over combined class keys (from * 10 + to) as a
+    dense area matrix, rows are from classes and columns are to classes.
+    :param groups: [{'type': 13, 'sum': 100.0}, ...]
+    :param classes: class values, e.g. [1, 2, 3, 4, 5, 6]
+    :return: [[area, ...], ...]
+    """
+    index = {c: i for i, c in enumerate(classes)}
+
+    matrix = [[0.0] * len(classes) for c in classes]
+
+    for g in groups:
+        row = index.get(int(g['type']) // 10)
+        column = index.get(int(g['type']) % 10)
+
+        if row is not None and column is not None:
+            matrix[row][column] = g['sum']
+
+    return matrix
+
+
+def pivot_groups(areas, classes):
+    """
+    Converts outputs of a grouped sum reducer per feature and time into a dense array
+    :param areas: per feature, per time a list of groups [{'type': 1, 'sum': 100.0}, ...]
+    :param classes: class values, e.g. [1, 2, 3, 4, 5, 6]
+    :return: array with shape (features, classes, times), NaN where a class has no area
+    """
+    n_times = max([len(a) for a in areas] or [0])
+
+    rows = [(i, j, g['type'], g['sum'])
+            for i, feature_areas in enumerate(areas)
+            for j, groups in enumerate(feature_areas)
+            for g in groups]
+
+    values = np.full((len(areas), len(classes), n_times), np.nan)
+
+    if not rows:
+        return values
+
+    feature_index, time_index, types, sums = np.array(rows, dtype=float).T
+
+    # map class values to class indices, skip unknown classes
+    lookup = np.full(int(max(types.max(), max(classes))) + 1, -1)
+    lookup[classes] = np.arange(len(classes))
+    class_index = lookup[types.astype(int)]
+
+    known = class_index >= 0
+
+    values[feature_index[known].astype(int), class_index[known], time_index[known].astype(int)] = sums[known]
+
+    return values
+
+
+def fill_gaps(values, fill):
+    """
+    Converts array to nested lists with NaN replaced by fill value
+    """
+    values_with_gaps = values.astype(object)
+    values_with_gaps[np.isnan(values)] = fill
+
+    return values_with_gaps.tolist()
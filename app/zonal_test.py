@@ -0,0 +1,130 @@
+import threading
+import time
+
+from . import zonal
+
+
+def test_iter_chunks():
+    chunks = list(zonal.iter_chunks(range(7), 3))
+
+    assert chunks == [[0, 1, 2], [3, 4, 5], [6]]
+
+
+def test_imap_chunks_keeps_order_of_items():
+    def fn(chunk):
+        # later chunks finish first
+        time.sleep(0.01 * (10 - chunk[0] // 10))
+        return [i * 2 for i in chunk]
+
+    results = list(zonal.imap_chunks(fn, range(100), chunk_size=10, max_workers=4))
+
+    assert results == [i * 2 for i in range(100)]
+
+
+def test_imap_chunks_bounds_concurrency():
+    lock = threading.Lock()
+    state = {'running': 0, 'max_running': 0}
+
+    def fn(chunk):
+        with lock:
+            state['running'] += 1
+            state['max_running'] = max(state['max_running'], state['running'])
+
+        time.sleep(0.01)
+
+        with lock:
+            state['running'] -= 1
+
+        return chunk
+
+    results = list(zonal.imap_chunks(fn, range(1000), chunk_size=10, max_workers=3))
+
+    assert len(results) == 1000
+    assert state['max_running'] <= 3
+
+
+def test_format_groups():
+    groups = [{'type': 1, 'sum': 10.5}, {'type': 6.0, 'sum': 2.0}]
+
+    assert zonal.format_groups(groups) == [{'type': '1', 'area': 10.5}, {'type': '6', 'area': 2.0}]
+
+
+def test_imap_cached_computes_missing_items_only():
+    from . import cache
+
+    results_cache = cache.TTLCache()
+    results_cache.set('b', 'B (cached)')
+
+    computed = []
+
+    def fn(chunk):
+        computed.extend(chunk)
+        return [item.upper() for item in chunk]
+
+    items = ['a', 'b', 'c', 'd']
+    results = list(zonal.imap_cached(fn, items, items, results_cache, chunk_size=2))
+
+    assert results == ['A', 'B (cached)', 'C', 'D']
+    assert computed == ['a', 'c', 'd']
+
+    results = list(zonal.imap_cached(fn, items, items, results_cache, chunk_size=2))
+
+    assert results == ['A', 'B (cached)', 'C', 'D']
+    assert computed == ['a', 'c', 'd']
+
+
+def test_format_transitions():
+    groups = [{'type': 11, 'sum': 5.0}, {'type': 13, 'sum': 2.0}, {'type': 62, 'sum': 1.0}, {'type': 70, 'sum': 9.0}]
+
+    matrix = zonal.format_transitions(groups, [1, 2, 3, 4, 5, 6])
+
+    assert len(matrix) == 6
+    assert matrix[0] == [5.0, 0.0, 2.0, 0.0, 0.0, 0.0]
+    assert matrix[5] == [0.0, 1.0, 0.0, 0.0, 0.0, 0.0]
+    assert sum(map(sum, matrix)) == 8.0
+
+
+def test_pivot_groups():
+    areas = [
+        [[{'type': 1, 'sum': 10.0}, {'type': 3, 'sum': 5.0}], [], [{'type': 6, 'sum': 1.0}]],
+        [[{'type': 2, 'sum': 7.0}, {'type': 0, 'sum': 3.0}], [{'type': 2, 'sum': 8.0}], []]
+    ]
+
+    values = zonal.pivot_groups(areas, [1, 2, 3, 4, 5, 6])
+
+    assert values.shape == (2, 6, 3)
+    assert values[0, 0, 0] == 10.0
+    assert values[0, 2, 0] == 5.0
+    assert values[0, 5, 2] == 1.0
+    assert values[1, 1].tolist()[:2] == [7.0, 8.0]
+
+    data = zonal.fill_gaps(values, '-')
+
+    assert data[0][0] == [10.0, '-', '-']
+    assert data[1][1] == [7.0, 8.0, '-']
+
+
+def test_pivot_groups_without_areas():
+    values = zonal.pivot_groups([[[]], [[]]], [1, 2, 3])
+
+    assert values.shape == (2, 3, 1)
+    assert zonal.fill_gaps(values, None) == [[[None]] * 3] * 2
+
+
+def test_get_periods():
+    from datetime import datetime
+
+    months = zonal.get_periods(datetime(2019, 11, 15), datetime(2020, 2, 1), 'month')
+
+    assert months == [
+        (datetime(2019, 11, 1), datetime(2019, 12, 1)),
+        (datetime(2019, 12, 1), datetime(2020, 1, 1)),
+        (datetime(2020, 1, 1), datetime(2020, 2, 1))
+    ]
+
+    seasons = zonal.get_periods(datetime(2019, 2, 10), datetime(2019, 6, 1), 'season')
+
+    assert seasons == [
+        (datetime(2018, 12, 1), datetime(2019, 3, 1)),
+        (datetime(2019, 3, 1), datetime(2019, 6, 1))
+    ]
@@ -0,0 +1,111 @@
+'''
+Compares wall time of writing tile cache records one by one (document.set()) and with BulkWriter
+(batches of up to 500 operations, committed concurrently), using a fake Firestore backend.
+
+The fake backend models every request as a fixed latency plus a cost per written document, a fraction
+of batch commits fails with contention and is retried.
+
+python benchmarks/bulk_writer_benchmark.py
+'''
+import argparse
+import os
+import random
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'app'))
+
+import bulk_writer  # noqa: E402
+
+
+class Contention(Exception):
+    pass
+
+
+class FakeFirestore(object):
+    def __init__(self, latency, document_cost, contention):
+        self.latency = latency
+        self.document_cost = document_cost
+        self.contention = contention
+        self.requests = 0
+        self.lock = threading.Lock()
+
+    def _request(self, documents):
+        with self.lock:
+            self.requests += 1
+
+        time.sleep(self.latency + documents * self.document_cost)
+
+    def document(self, id):
+        return FakeDocumentReference(self, id)
+
+    def batch(self):
+        return FakeBatch(self)
+
+
+class FakeDocumentReference(object):
+    def __init__(self, db, id):
+        self.db = db
+        self.id = id
+
+    def set(self, data):
+        self.db._request(1)
+
+    def delete(self):
+        self.db._request(1)
+
+
+class FakeBatch(object):
+    def __init__(self, db):
+        self.db = db
+        self.operations = 0
+
+    def set(self, reference, data):
+        self.operations += 1
+
+    def delete(self, reference):
+        self.operations += 1
+
+    def commit(self):
+        self.db._request(self.operations)
+
+        if random.random() < self.db.contention:
+            raise Contention()
+
+
+def run(counts, latency, document_cost, contention, batch_size, max_workers):
+    print('{0:>8} {1:>12} {2:>10} {3:>10} {4:>10} {5:>10}'.format(
+        'records', 'one by one s', 'requests', 'bulk s', 'requests', 'retries'))
+
+    for n in counts:
+        db = FakeFirestore(latency, document_cost, 0)
+        t = time.time()
+        for i in range(n):
+            db.document(str(i)).set({'image_time': i})
+        single_time = time.time() - t
+        single_requests = db.requests
+
+        db = FakeFirestore(latency, document_cost, contention)
+        t = time.time()
+        with bulk_writer.BulkWriter(db, batch_size, max_workers, retry_exceptions=(Contention,),
+                                    retry_delay=latency) as writer:
+            for i in range(n):
+                writer.set(db.document(str(i)), {'image_time': i})
+        bulk_time = time.time() - t
+
+        print('{0:>8} {1:>12.3f} {2:>10} {3:>10.3f} {4:>10} {5:>10}'.format(
+            n, single_time, single_requests, bulk_time, db.requests, writer.retries))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--counts', type=int, nargs='+', default=[100, 500, 2000])
+    parser.add_argument('--latency', type=float, default=0.01, help='seconds per request')
+    parser.add_argument('--document-cost', type=float, default=0.0001, help='seconds per written document')
+    parser.add_argument('--contention', type=float, default=0.05, help='fraction of failing batch commits')
+    parser.add_argument('--batch-size', type=int, default=500)
+    parser.add_argument('--max-workers', type=int, default=4)
+    args = parser.parse_args()
+
+    run(args.counts, args.latency, args.document_cost, args.contention, args.batch_size, args.max_workers)
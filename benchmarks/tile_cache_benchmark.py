@@ -0,0 +1,127 @@
+'''
+Compares documents read and wall time of get_times_by_tiles queries for a single range scan on the
+compound tile index (txty) and per-column range queries, for different viewport shapes, using a fake
+Firestore backend.
+
+The fake backend models every query as a fixed request latency plus a cost per document read.
+
+python benchmarks/tile_cache_benchmark.py
+'''
+import argparse
+import bisect
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'app'))
+
+import tile_cache  # noqa: E402
+
+
+class FakeDocument(object):
+    def __init__(self, data):
+        self.data = data
+
+    def to_dict(self):
+        return self.data
+
+
+class FakeCollection(object):
+    """
+    Documents sorted by txty, supports where(txty >= ...).where(txty <= ...).select(...).stream()
+    """
+
+    def __init__(self, documents, latency, document_cost):
+        self.documents = sorted(documents, key=lambda d: d['txty'])
+        self.keys = [d['txty'] for d in self.documents]
+        self.latency = latency
+        self.document_cost = document_cost
+        self.reads = 0
+        self.queries = 0
+
+    def where(self, field, op, value):
+        return _FakeQuery(self).where(field, op, value)
+
+
+class _FakeQuery(object):
+    def __init__(self, collection, txty_min=None, txty_max=None):
+        self.collection = collection
+        self.txty_min = txty_min
+        self.txty_max = txty_max
+
+    def where(self, field, op, value):
+        if op == '>=':
+            return _FakeQuery(self.collection, value, self.txty_max)
+
+        return _FakeQuery(self.collection, self.txty_min, value)
+
+    def select(self, fields):
+        return self
+
+    def stream(self):
+        c = self.collection
+
+        begin = bisect.bisect_left(c.keys, self.txty_min)
+        end = bisect.bisect_right(c.keys, self.txty_max)
+
+        c.queries += 1
+        c.reads += end - begin
+        time.sleep(c.latency + (end - begin) * c.document_cost)
+
+        return [FakeDocument(d) for d in c.documents[begin:end]]
+
+
+def get_documents(tx_range, ty_range, images_per_tile):
+    return [{'txty': tile_cache.compound_tile_index(tx, ty), 'image_time': i}
+            for tx in tx_range for ty in ty_range for i in range(images_per_tile)]
+
+
+def query_range(collection, tiles_min, tiles_max):
+    """
+    Single range scan from tilesMin to tilesMax, as before
+    """
+    txty_min = tile_cache.compound_tile_index(tiles_min['tx'], tiles_min['ty'])
+    txty_max = tile_cache.compound_tile_index(tiles_max['tx'], tiles_max['ty'])
+
+    return [d.to_dict() for d in collection.where('txty', '>=', txty_min).where('txty', '<=', txty_max)
+            .select(['image_time']).stream()]
+
+
+def run(viewports, latency, document_cost, images_per_tile, max_workers):
+    # z10 tiles covering the Netherlands
+    documents = get_documents(range(515, 535), range(325, 345), images_per_tile)
+
+    print('{0:>10} {1:>10} {2:>10} {3:>10} {4:>10} {5:>10} {6:>10}'.format(
+        'viewport', 'returned', 'range read', 'range s', 'cols read', 'cols s', 'queries'))
+
+    for width, height in viewports:
+        tiles_min = {'tx': 520, 'ty': 330}
+        tiles_max = {'tx': 520 + width - 1, 'ty': 330 + height - 1}
+
+        collection = FakeCollection(documents, latency, document_cost)
+        t = time.time()
+        query_range(collection, tiles_min, tiles_max)
+        range_time = time.time() - t
+        range_reads = collection.reads
+
+        collection = FakeCollection(documents, latency, document_cost)
+        t = time.time()
+        result = tile_cache.query_tiles(collection, tiles_min, tiles_max, ['image_time'], max_workers)
+        columns_time = time.time() - t
+
+        print('{0:>10} {1:>10} {2:>10} {3:>10.3f} {4:>10} {5:>10.3f} {6:>10}'.format(
+            '{0}x{1}'.format(width, height), len(result), range_reads, range_time,
+            collection.reads, columns_time, collection.queries))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--latency', type=float, default=0.05, help='seconds per query')
+    parser.add_argument('--document-cost', type=float, default=0.00002, help='seconds per document read')
+    parser.add_argument('--images-per-tile', type=int, default=70)
+    parser.add_argument('--max-workers', type=int, default=8)
+    args = parser.parse_args()
+
+    viewports = [(1, 1), (2, 2), (4, 4), (8, 2), (2, 8), (8, 8)]
+
+    run(viewports, args.latency, args.document_cost, args.images_per_tile, args.max_workers)
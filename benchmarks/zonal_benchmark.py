@@ -0,0 +1,79 @@
+'''
+Compares wall time of zonal statistics for the per-feature (toList(5000).map(reduceRegion)) and the
+batched (chunked reduceRegions) approach, using a fake EE backend.
+
+The fake backend models every getInfo() call as a fixed request latency plus a cost per feature.
+A mapped list expression additionally pays a cost per feature for the size of the expression graph.
+
+python benchmarks/zonal_benchmark.py
+'''
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'app'))
+
+import zonal  # noqa: E402
+
+
+class FakeEarthEngine(object):
+    def __init__(self, latency, feature_cost, graph_cost):
+        self.latency = latency
+        self.feature_cost = feature_cost
+        self.graph_cost = graph_cost
+        self.calls = 0
+
+    def get_info_mapped_list(self, features):
+        """
+        One getInfo() of features.toList(5000).map(get_feature_info)
+        """
+        self.calls += 1
+        features = features[:5000]
+        time.sleep(self.latency + len(features) * (self.feature_cost + self.graph_cost))
+
+        return [[{'type': 1, 'sum': 100.0}] for _ in features]
+
+    def get_info_reduce_regions(self, features):
+        """
+        One getInfo() of image.reduceRegions(chunk).aggregate_array('groups')
+        """
+        self.calls += 1
+        time.sleep(self.latency + len(features) * self.feature_cost)
+
+        return [[{'type': 1, 'sum': 100.0}] for _ in features]
+
+
+def run(counts, latency, feature_cost, graph_cost, chunk_size, max_workers):
+    print('{0:>8} {1:>14} {2:>10} {3:>14} {4:>10} {5:>8}'.format(
+        'features', 'per-feature s', 'returned', 'batched s', 'returned', 'calls'))
+
+    for n in counts:
+        features = list(range(n))
+
+        backend = FakeEarthEngine(latency, feature_cost, graph_cost)
+        t = time.time()
+        legacy = backend.get_info_mapped_list(features)
+        legacy_time = time.time() - t
+
+        backend = FakeEarthEngine(latency, feature_cost, graph_cost)
+        t = time.time()
+        batched = list(zonal.imap_chunks(backend.get_info_reduce_regions, features, chunk_size, max_workers))
+        batched_time = time.time() - t
+
+        print('{0:>8} {1:>14.3f} {2:>10} {3:>14.3f} {4:>10} {5:>8}'.format(
+            n, legacy_time, len(legacy), batched_time, len(batched), backend.calls))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--counts', type=int, nargs='+', default=[10, 100, 1000, 10000])
+    parser.add_argument('--latency', type=float, default=0.2, help='seconds per request')
+    parser.add_argument('--feature-cost', type=float, default=0.0005, help='seconds per feature')
+    parser.add_argument('--graph-cost', type=float, default=0.0005,
+                        help='seconds per feature for a mapped list expression')
+    parser.add_argument('--chunk-size', type=int, default=200)
+    parser.add_argument('--max-workers', type=int, default=4)
+    args = parser.parse_args()
+
+    run(args.counts, args.latency, args.feature_cost, args.graph_cost, args.chunk_size, args.max_workers)